@@ -0,0 +1,156 @@
+# xiaomi.py 吞吐量压测：启动本地模拟服务（mock_server.py），用合成账号驱动 RNL 和多账号执行器，
+# 统计每分钟处理账号数、单账号耗时 p50/p95 和峰值内存，不会访问真实接口；
+# 每个引擎/账号数组合在独立的子进程中执行，峰值内存只反映这一组
+# 用法: python benchmark.py --accounts 10,100,1000 --engine thread,wheel --workers 16
+
+import os
+import json
+import time
+import asyncio
+import argparse
+import resource
+import tempfile
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from mock_server import MockActivityServer
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="xiaomi.py 吞吐量压测")
+    parser.add_argument('--accounts', default='10,100,1000', help="逗号分隔的合成账号数，默认 10,100,1000")
+    parser.add_argument('--engine', default='thread', help="逗号分隔的执行引擎（thread/async/wheel），默认 thread")
+    parser.add_argument('-w', '--workers', type=int, default=16, help="线程数或 async 并发数，默认 16")
+    parser.add_argument('--max-active', type=int, default=500, help="wheel 引擎同时执行的账号上限，默认 500")
+    parser.add_argument('--pool-size', type=int, default=20, help="async 引擎连接池大小，默认 20")
+    parser.add_argument('--dwell-scale', type=float, default=0.01,
+                        help="任务停留时间倍率，1 为线上真实的 13s/2s 等待，默认 0.01")
+    parser.add_argument('--latency', type=float, default=50, help="模拟服务平均延迟（毫秒），默认 50")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="模拟服务返回 HTTP 500 的概率")
+    parser.add_argument('--no-chance-rate', type=float, default=0.0, help="模拟服务额外返回 10101 的概率")
+    parser.add_argument('--mock-url', help="使用已启动的模拟服务地址，不在本进程内启动")
+    parser.add_argument('--json', help="把结果另存为 JSON 文件")
+    return parser.parse_args(argv)
+
+
+def make_accounts(count):
+    """生成合成账号，10 个 owner 轮流归属"""
+    return [
+        {
+            "owner_id": 1000 + i % 10,
+            "data": {
+                "us": f"bench{i}",
+                "userId": str(10 ** 9 + i),
+                "passToken": f"pt-{i}",
+                "securityToken": "",
+            },
+        }
+        for i in range(count)
+    ]
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    # Linux 下 ru_maxrss 的单位是 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_once(engine, count, args, workdir):
+    """在子进程中用指定引擎跑一轮 count 个账号，返回统计结果"""
+    # 接口地址和停留倍率由父进程通过环境变量传入
+    import xiaomi
+
+    accounts = make_accounts(count)
+    config_path = os.path.join(workdir, f"xiaomiconfig-{engine}-{count}.json")
+    with open(config_path, "w", encoding="utf-8") as f:
+        json.dump(accounts, f, ensure_ascii=False)
+    # 收集每个账号的执行结果（含单账号耗时），不打印通知文本
+    collector = xiaomi.OwnerGroupSink()
+    ctx = xiaomi.RunContext(
+        config_path=config_path, cookie_cache=None, log_flush_interval=0,
+        report=xiaomi.RunReport([collector]),
+    )
+
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        if engine == 'async':
+            report = asyncio.run(xiaomi.run_accounts_async(
+                accounts, concurrency=args.workers, pool_size=args.pool_size, ctx=ctx,
+            ))
+        elif engine == 'wheel':
+            report = xiaomi.run_accounts_wheel(
+                accounts, workers=args.workers, max_active=args.max_active, ctx=ctx,
+            )
+        else:
+            report = xiaomi.run_accounts(accounts, workers=args.workers, ctx=ctx)
+        ctx.close()
+    elapsed = time.perf_counter() - start
+    durations = [r.elapsed for results in collector.groups.values() for r in results]
+
+    return {
+        "engine": engine,
+        "accounts": count,
+        "succeeded": report.success_count,
+        "elapsed": round(elapsed, 3),
+        "accounts_per_minute": round(count / elapsed * 60, 1) if elapsed else 0.0,
+        "p50": round(percentile(durations, 50), 3),
+        "p95": round(percentile(durations, 95), 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def main():
+    args = parse_args()
+    server = None
+    base_url = args.mock_url
+    if not base_url:
+        server = MockActivityServer(
+            latency=args.latency / 1000,
+            error_rate=args.error_rate,
+            no_chance_rate=args.no_chance_rate,
+        )
+        base_url = server.start()
+
+    # xiaomi.py 在导入时读取接口地址和停留倍率，必须先设置好环境变量（子进程继承）
+    os.environ['XIAOMI_API_BASE'] = base_url
+    os.environ['XIAOMI_ACCOUNT_BASE'] = base_url
+    os.environ['XIAOMI_DWELL_SCALE'] = str(args.dwell_scale)
+    import xiaomi
+
+    engines = [e.strip() for e in args.engine.split(',') if e.strip()]
+    counts = [int(n) for n in args.accounts.split(',') if n.strip()]
+    print(f"模拟服务: {base_url}  停留倍率: {args.dwell_scale}  并发: {args.workers}")
+    print(f"{'引擎':<8}{'账号数':>8}{'成功':>8}{'总耗时(s)':>12}{'账号/分钟':>12}{'p50(s)':>10}{'p95(s)':>10}{'峰值内存(MB)':>14}")
+    rows = []
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for engine in engines:
+                if engine == 'async' and xiaomi.aiohttp is None:
+                    print("async 引擎需要安装 aiohttp，已跳过")
+                    continue
+                for count in counts:
+                    # 每组使用新的子进程，ru_maxrss 不会带上之前各组的峰值
+                    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+                        row = pool.submit(run_once, engine, count, args, workdir).result()
+                    rows.append(row)
+                    print(f"{row['engine']:<8}{row['accounts']:>8}{row['succeeded']:>8}{row['elapsed']:>12}"
+                          f"{row['accounts_per_minute']:>12}{row['p50']:>10}{row['p95']:>10}{row['peak_rss_mb']:>14}")
+    finally:
+        if server:
+            server.stop()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# JSON 编解码压测：用合成的 1 万账号配置（带执行日志）比较标准库 json（原来的 indent=4 写法）
+# 与 jsoncodec（安装 orjson 时使用 orjson）的解析和序列化耗时，以及紧凑/缩进两种格式的文件大小。
+# 用法: python benchmark_json.py --accounts 10000 --repeat 5
+
+import io
+import json
+import time
+import argparse
+
+import jsoncodec
+
+LOG_TEMPLATE = (
+    "【账号信息】\n\n✨ 账号：{us} ID:{user_id}\n📊 当前兑换视频天数：8.01天\n\n📅 2025-07-02 任务记录\n"
+    + "-" * 40
+    + "\n⏰ 2025-07-02 01:54:50\n🎁 领到视频会员，+0.50天\n⏰ 2025-07-02 01:54:33\n🎁 领到视频会员，+0.25天\n"
+    + "=" * 40
+)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="JSON 编解码压测")
+    parser.add_argument('--accounts', type=int, default=10000, help="合成账号数，默认 10000")
+    parser.add_argument('--repeat', type=int, default=5, help="每项重复次数，取最快一次，默认 5")
+    return parser.parse_args(argv)
+
+
+def make_config(count):
+    return [
+        {
+            "owner_id": 1000 + i % 50,
+            "data": {
+                "us": f"账号{i}",
+                "userId": str(2423574306 + i),
+                "passToken": f"V1:{'x' * 180}{i}",
+                "securityToken": "",
+                "log": LOG_TEMPLATE.format(us=f"账号{i}", user_id=2423574306 + i),
+            },
+        }
+        for i in range(count)
+    ]
+
+
+def best_of(repeat, func):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    args = parse_args()
+    config = make_config(args.accounts)
+    stdlib_text = json.dumps(config, ensure_ascii=False, indent=4)
+    pretty = jsoncodec.dumpb(config, indent=True)
+    compact = jsoncodec.dumpb(config)
+
+    rows = [
+        ("解析", "json.loads（原写法）", best_of(args.repeat, lambda: json.loads(stdlib_text)), None),
+        ("解析", f"jsoncodec.loads（{jsoncodec.BACKEND}）", best_of(args.repeat, lambda: jsoncodec.loads(compact)), None),
+        ("解析", "jsoncodec.iter_array（逐个账号）",
+         best_of(args.repeat, lambda: list(jsoncodec.iter_array(io.StringIO(stdlib_text)))), None),
+        ("序列化", "json.dump indent=4（原写法）",
+         best_of(args.repeat, lambda: json.dumps(config, ensure_ascii=False, indent=4).encode('utf-8')),
+         len(stdlib_text.encode('utf-8'))),
+        ("序列化", "jsoncodec 缩进（json，四格）",
+         best_of(args.repeat, lambda: jsoncodec.dumpb(config, indent=True)), len(pretty)),
+        ("序列化", f"jsoncodec 紧凑（{jsoncodec.BACKEND}）",
+         best_of(args.repeat, lambda: jsoncodec.dumpb(config)), len(compact)),
+    ]
+
+    print(f"账号数: {args.accounts}  JSON 实现: {jsoncodec.BACKEND}  重复: {args.repeat} 次取最快")
+    # 各类以原写法为基准计算倍数
+    baseline = {kind: seconds for kind, name, seconds, _ in rows if "原写法" in name}
+    for kind, name, seconds, size in rows:
+        speedup = baseline[kind] / seconds if seconds else 0
+        size_text = f"{size / 1024 / 1024:8.2f} MB" if size else " " * 11
+        print(f"{kind:<4}{name:<34}{seconds * 1000:10.1f} ms  {speedup:5.1f}x  {size_text}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+# HTTP 录制/回放：把 RnlRequest、get_xiaomi_cookies 和扫码登录轮询经过的请求和响应录入 cassette 文件，
+# 之后离线按原始（或缩放后的）耗时回放，用于无真实账号时的性能分析和回归测试。
+# 录制: XIAOMI_CASSETTE=run.jsonl.gz XIAOMI_CASSETTE_MODE=record python xiaomi.py
+# 回放: XIAOMI_CASSETTE=run.jsonl.gz XIAOMI_CASSETTE_MODE=replay XIAOMI_CASSETTE_SCALE=0 python xiaomi.py
+# 文件中的 passToken、serviceToken 等敏感值会替换为不可逆的哈希，回放时对实时请求做同样的替换后再匹配。
+
+import io
+import os
+import atexit
+import gzip
+import jsoncodec
+import time
+import base64
+import hashlib
+import threading
+from collections import defaultdict, deque
+from http.client import HTTPMessage
+from http.cookies import SimpleCookie
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPResponse
+from urllib3._collections import HTTPHeaderDict
+
+# 需要脱敏的 Cookie / 查询参数 / 表单字段 / JSON 字段名
+SENSITIVE_NAMES = {
+    'passToken', 'serviceToken', 'jrairstar_serviceToken', 'securityToken', 'ssecurity',
+    'cUserId', 'userId', 'nonce', 'clientSign', '_ssign', 'ticket',
+}
+# 每次请求都会变化、不参与匹配的查询参数
+VOLATILE_PARAMS = {'_dc'}
+SCRUB_PREFIX = 'scrubbed-'
+# 回放时不需要也无法还原的响应头
+DROP_HEADERS = {'content-encoding', 'transfer-encoding', 'content-length', 'connection'}
+
+
+def scrub(value):
+    """把敏感值替换为稳定的哈希占位符；已经替换过的值保持不变，回放时同一个值得到同一个占位符"""
+    if value is None:
+        return None
+    value = str(value)
+    if not value or value == 'None' or value.startswith(SCRUB_PREFIX):
+        return value
+    return SCRUB_PREFIX + hashlib.sha256(value.encode('utf-8')).hexdigest()[:16]
+
+
+def scrub_pairs(pairs, drop=()):
+    return [(k, scrub(v) if k in SENSITIVE_NAMES else v) for k, v in pairs if k not in drop]
+
+
+def scrub_url(url, drop=()):
+    parts = urlsplit(url)
+    query = urlencode(scrub_pairs(parse_qsl(parts.query, keep_blank_values=True), drop))
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, query, parts.fragment))
+
+
+def scrub_json(data):
+    if isinstance(data, dict):
+        return {k: scrub(v) if k in SENSITIVE_NAMES and isinstance(v, (str, int)) else scrub_json(v)
+                for k, v in data.items()}
+    if isinstance(data, list):
+        return [scrub_json(v) for v in data]
+    return data
+
+
+def scrub_body(text):
+    """JSON（包括带 &&&START&&& 前缀的登录接口响应）按字段脱敏，表单按字段脱敏"""
+    prefix = ''
+    payload = text
+    if '&&&START&&&' in text:
+        prefix, payload = text.split('&&&START&&&', 1)
+        prefix += '&&&START&&&'
+    try:
+        return prefix + jsoncodec.dumps(scrub_json(jsoncodec.loads(payload)))
+    except ValueError:
+        pass
+    if '=' in text and ' ' not in text.strip():
+        return urlencode(scrub_pairs(parse_qsl(text, keep_blank_values=True)))
+    return text
+
+
+def scrub_set_cookie(header):
+    cookie = SimpleCookie()
+    try:
+        cookie.load(header)
+    except Exception:
+        return header
+    for name, morsel in cookie.items():
+        if name in SENSITIVE_NAMES:
+            header = header.replace(f"{name}={morsel.coded_value}", f"{name}={scrub(morsel.value)}", 1)
+    return header
+
+
+def scrub_header(name, value):
+    lower = name.lower()
+    if lower == 'set-cookie':
+        return scrub_set_cookie(value)
+    if lower == 'location':
+        return scrub_url(value)
+    return value
+
+
+def request_key(request):
+    """回放匹配用的请求标识：方法 + 脱敏后的地址和请求体 + 账号标识"""
+    body = request.body
+    if isinstance(body, bytes):
+        body = body.decode('utf-8', 'replace')
+    cookies = dict(
+        item.strip().split('=', 1)
+        for item in (request.headers.get('Cookie') or '').split(';')
+        if '=' in item
+    )
+    account = scrub(cookies.get('cUserId') or cookies.get('userId') or '')
+    return [
+        request.method,
+        scrub_url(request.url, drop=VOLATILE_PARAMS),
+        scrub_body(body) if body else '',
+        account,
+    ]
+
+
+class _ReplayOriginal:
+    """代替 http.client.HTTPResponse，requests 从 msg 中解析 Set-Cookie"""
+
+    def __init__(self, headers):
+        self.msg = HTTPMessage()
+        for name, value in headers:
+            self.msg[name] = value
+
+    def isclosed(self):
+        return True
+
+    def close(self):
+        pass
+
+
+class Cassette:
+    """
+    录制模式下把每次请求的响应追加写入 cassette 文件（.gz 结尾时压缩）；
+    回放模式下按请求标识依次返回录制的响应，同一请求录制了多次时按顺序返回，用完后重复最后一次。
+    scale 为回放耗时相对录制耗时的倍率，0 表示不等待。
+    """
+
+    def __init__(self, path, mode='replay', scale=1.0):
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"cassette 模式应为 record 或 replay: {mode}")
+        self.path = path
+        self.mode = mode
+        self.scale = scale
+        self._lock = threading.Lock()
+        self._file = None
+        self._exchanges = defaultdict(deque)
+        self._last = {}
+        if mode == 'record':
+            self._file = self._open('wt')
+        else:
+            self._load()
+
+    def _open(self, mode):
+        if self.path.endswith('.gz'):
+            return gzip.open(self.path, mode, encoding='utf-8')
+        return open(self.path, mode, encoding='utf-8')
+
+    def _load(self):
+        with self._open('rt') as f:
+            try:
+                for line in f:
+                    if line.strip():
+                        exchange = jsoncodec.loads(line)
+                        self._exchanges[jsoncodec.dumps(exchange['key'])].append(exchange)
+            except (EOFError, ValueError):
+                # 录制进程被强制结束时文件末尾可能不完整，已读到的部分仍可回放
+                pass
+
+    def record(self, request, response, elapsed):
+        content = response.content
+        try:
+            body, encoding = scrub_body(content.decode('utf-8')), 'text'
+        except UnicodeDecodeError:
+            body, encoding = base64.b64encode(content).decode('ascii'), 'base64'
+        exchange = {
+            'key': request_key(request),
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': [
+                [name, scrub_header(name, value)]
+                for name, value in response.raw.headers.items()
+                if name.lower() not in DROP_HEADERS
+            ],
+            'body': body,
+            'encoding': encoding,
+            'elapsed': round(elapsed, 4),
+        }
+        line = jsoncodec.dumps(exchange)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def lookup(self, request):
+        key = jsoncodec.dumps(request_key(request))
+        with self._lock:
+            queue = self._exchanges.get(key)
+            if queue:
+                exchange = self._last[key] = queue.popleft()
+            else:
+                exchange = self._last.get(key)
+        if exchange is None:
+            raise requests.ConnectionError(f"cassette 中没有匹配的请求: {key}", request=request)
+        return exchange
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+
+class CassetteAdapter(HTTPAdapter):
+    """挂到 requests.Session 上的传输层：录制时透传并记录，回放时不访问网络"""
+
+    def __init__(self, cassette, **kwargs):
+        self.cassette = cassette
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if self.cassette.mode == 'record':
+            start = time.perf_counter()
+            response = super().send(request, **kwargs)
+            self.cassette.record(request, response, time.perf_counter() - start)
+            return response
+
+        exchange = self.cassette.lookup(request)
+        if exchange['elapsed'] and self.cassette.scale > 0:
+            time.sleep(exchange['elapsed'] * self.cassette.scale)
+        if exchange['encoding'] == 'base64':
+            content = base64.b64decode(exchange['body'])
+        else:
+            content = exchange['body'].encode('utf-8')
+        headers = [tuple(h) for h in exchange['headers']] + [('Content-Length', str(len(content)))]
+        raw = HTTPResponse(
+            body=io.BytesIO(content),
+            headers=HTTPHeaderDict(headers),
+            status=exchange['status'],
+            reason=exchange['reason'],
+            preload_content=False,
+            decode_content=False,
+            original_response=_ReplayOriginal(headers),
+        )
+        return self.build_response(request, raw)
+
+
+_active = None
+_active_lock = threading.Lock()
+
+
+def active_cassette():
+    """按环境变量 XIAOMI_CASSETTE / XIAOMI_CASSETTE_MODE / XIAOMI_CASSETTE_SCALE 创建进程内唯一的 cassette"""
+    global _active
+    path = os.environ.get('XIAOMI_CASSETTE')
+    if not path:
+        return None
+    with _active_lock:
+        if _active is None:
+            _active = Cassette(
+                path,
+                mode=os.environ.get('XIAOMI_CASSETTE_MODE', 'replay'),
+                scale=float(os.environ.get('XIAOMI_CASSETTE_SCALE', '1')),
+            )
+            atexit.register(_active.close)
+        return _active
+
+
+def new_session(adapter=None):
+    """创建 requests.Session，启用 cassette 时挂载录制/回放传输层，否则挂载传入的（共享）传输层"""
+    session = requests.Session()
+    cassette = active_cassette()
+    if cassette:
+        adapter = CassetteAdapter(cassette)
+    if adapter:
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+    return session
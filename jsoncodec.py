@@ -0,0 +1,186 @@
+# 统一的 JSON 编解码：安装了 orjson 时使用 orjson，否则回退到标准库 json。
+# 只给程序读写的文件（缓存、日志、报告）使用紧凑格式；需要人工查看的文件按原来的缩进写入（账号配置 indent=True 即四格，授权信息 indent=2）。
+# 很大的数组文件（账号配置）可以用 iter_array 逐个元素读取，不必一次读入整个文件。
+# 多个进程（xiaomi.py 的分片/队列进程、常驻进程、机器人调用的 login.py）共用的文件用 file_lock 串行化读-改-写，
+# 用 write_file 原子替换，读取方不会读到写了一半的文件。
+
+import os
+import re
+import json
+import threading
+from contextlib import contextmanager
+
+try:
+    # Windows 下没有 fcntl，不加跨进程锁
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = 'orjson' if orjson else 'json'
+
+# orjson.JSONDecodeError 是 json.JSONDecodeError 的子类，两种实现抛出的解析错误都能用它捕获
+JSONDecodeError = json.JSONDecodeError
+
+
+def loads(data):
+    """解析 str 或 bytes"""
+    if orjson:
+        return orjson.loads(data)
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+
+def dumpb(obj, indent=False):
+    """
+    序列化为 UTF-8 bytes；indent 为 True 时与原来手工维护的账号配置一样缩进四格，为整数时按该宽度缩进，便于人工查看。
+    缩进输出只用于很少写入的文件，始终使用标准库，保持各文件原来的缩进（否则整个文件都会发生变化）。
+    """
+    if orjson and not indent:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # 超出 64 位的整数等 orjson 不支持的值交给标准库处理
+            pass
+    return _stdlib_dumps(obj, indent).encode('utf-8')
+
+
+def dumps(obj, indent=False):
+    """序列化为 str，非 ASCII 字符原样输出"""
+    if orjson and not indent:
+        return dumpb(obj).decode('utf-8')
+    return _stdlib_dumps(obj, indent)
+
+
+def _stdlib_dumps(obj, indent):
+    if indent:
+        return json.dumps(obj, ensure_ascii=False, indent=4 if indent is True else indent)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+def load(f):
+    """从以文本或二进制模式打开的文件中读取"""
+    return loads(f.read())
+
+
+def dump(obj, f, indent=False):
+    """写入以文本模式打开的文件"""
+    f.write(dumps(obj, indent))
+
+
+def write_file(path, obj, indent=False):
+    """先写入同目录下的临时文件再重命名，进程中途退出也不会留下半截文件"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(dumpb(obj, indent))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+@contextmanager
+def file_lock(path):
+    """跨进程互斥：对 path 的读-合并-写在 path.lock 上加排他锁"""
+    if fcntl is None:
+        yield
+        return
+    with open(f"{path}.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_NUMBER_CHARS = frozenset('0123456789.eE+-')
+
+
+def iter_array(f, chunk_size=1 << 16):
+    """
+    逐个解析以文本模式打开的文件中顶层 JSON 数组的元素，按块读取，内存占用与单个元素相当。
+    使用标准库的解析器（orjson 不支持增量解析）；格式错误时抛出的 JSONDecodeError 带有在整个文件中的位置。
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+    # 已丢弃部分的字符数、行数，以及缓冲区开头所在的列，用于换算错误位置
+    offset = lines = column = 0
+
+    def fill():
+        nonlocal buf, pos, eof, offset, lines, column
+        consumed = buf[:pos]
+        newlines = consumed.count('\n')
+        if newlines:
+            column = len(consumed) - consumed.rfind('\n') - 1
+        else:
+            column += len(consumed)
+        offset += len(consumed)
+        lines += newlines
+        # 单个元素超过块大小时按缓冲区大小翻倍读取，避免反复重新解析
+        chunk = f.read(max(chunk_size, len(buf) - pos))
+        eof = not chunk
+        buf = buf[pos:] + chunk
+        pos = 0
+
+    def skip_whitespace():
+        nonlocal pos
+        while True:
+            pos = _WHITESPACE.match(buf, pos).end()
+            if pos < len(buf) or eof:
+                return
+            fill()
+
+    def error(msg, at=None, cause=None):
+        e = cause or json.JSONDecodeError(msg, buf, pos if at is None else at)
+        located = json.JSONDecodeError(e.msg, buf, e.pos)
+        located.pos = offset + e.pos
+        located.lineno = lines + e.lineno
+        located.colno = column + e.colno if e.lineno == 1 else e.colno
+        located.args = (f"{e.msg}: line {located.lineno} column {located.colno} (char {located.pos})",)
+        return located
+
+    skip_whitespace()
+    if buf[pos:pos + 1] != '[':
+        raise error("Expecting '['")
+    pos += 1
+    first = True
+    while True:
+        skip_whitespace()
+        if buf[pos:pos + 1] == ']':
+            pos += 1
+            skip_whitespace()
+            if pos < len(buf):
+                raise error("Extra data")
+            return
+        if not first:
+            if buf[pos:pos + 1] != ',':
+                raise error("Expecting ',' delimiter")
+            pos += 1
+            skip_whitespace()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise error(e.msg, cause=e) from None
+                fill()
+                continue
+            # 数字没有结束符，可能被块边界截断（如 1.5 只读到 1.），读到后续内容再确认
+            if not eof and (end == len(buf) or buf[end] in _NUMBER_CHARS):
+                fill()
+                continue
+            break
+        pos = end
+        first = False
+        yield value
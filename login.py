@@ -2,9 +2,9 @@
 # 适用: 青龙面板
 # 注意：此脚本不自动运行，需手动执行
 
-import requests
+from cassette import new_session
 import time
-import json
+import jsoncodec
 from typing import List, Dict
 import traceback
 import os
@@ -31,47 +31,48 @@ class XiaomiAccount:
         self.security_token = security_token
 
     @staticmethod
-    def load_accounts(config_path: str = "xiaomiconfig.json") -> List[Dict]:
-        """加载账号配置"""
+    def _print_load_error(e, config_path):
+        if isinstance(e, jsoncodec.JSONDecodeError):
+            print(f"❌ JSON格式错误: {e.msg}")
+            print(f"错误位置: 行 {e.lineno}, 列 {e.colno}")
+        elif isinstance(e, PermissionError):
+            print(f"❌ 权限不足，无法读取文件: {config_path}")
+        else:
+            print(f"❌ 未知错误: {str(e)}")
+            traceback.print_exc()
+
+    @classmethod
+    def load_accounts(cls, config_path: str = "xiaomiconfig.json") -> List[Dict]:
+        """加载账号配置，读取失败时返回空列表"""
         # 检查文件是否存在
         if not os.path.isfile(config_path):
             print(f"❌ 配置文件不存在: {config_path}")
             return []
-        
         try:
-            # 尝试读取文件
-            with open(config_path, "r", encoding="utf-8") as f:
-                try:
-                    # 解析JSON
-                    return json.load(f)
-                except json.JSONDecodeError as e:
-                    print(f"❌ JSON格式错误: {e.msg}")
-                    print(f"错误位置: 行 {e.lineno}, 列 {e.colno}")
-                    return []
-        except PermissionError:
-            print(f"❌ 权限不足，无法读取文件: {config_path}")
-            return []
+            with open(config_path, "rb") as f:
+                return jsoncodec.load(f)
         except Exception as e:
-            print(f"❌ 未知错误: {str(e)}")
-            traceback.print_exc()
+            cls._print_load_error(e, config_path)
             return []
-    
+
     @classmethod
     def from_json(cls, us, owner_id, config_path="xiaomiconfig.json"):
-        accounts = cls.load_accounts(config_path)
-        for acc in accounts:
-            data = acc.get("data", {})
-            acc_us = data.get("us")
-            if isinstance(acc_us, str):
-                acc_us = acc_us.strip()
-            if acc.get("owner_id") == owner_id and acc_us == us.strip():
-                return cls(
-                    us=acc_us,
-                    owner_id=owner_id,
-                    user_id=data.get("userId"),
-                    pass_token=data.get("passToken"),
-                    security_token=data.get("securityToken")
-                )
+        try:
+            for acc in cls.load_accounts(config_path):
+                data = acc.get("data", {})
+                acc_us = data.get("us")
+                if isinstance(acc_us, str):
+                    acc_us = acc_us.strip()
+                if acc.get("owner_id") == owner_id and acc_us == us.strip():
+                    return cls(
+                        us=acc_us,
+                        owner_id=owner_id,
+                        user_id=data.get("userId"),
+                        pass_token=data.get("passToken"),
+                        security_token=data.get("securityToken")
+                    )
+        except Exception as e:
+            cls._print_load_error(e, config_path)
         return None
 
     def save_to_json(self, config_path="xiaomiconfig.json"):
@@ -87,38 +88,40 @@ class XiaomiAccount:
             if _should_stop:
                 print("收到终止信号，停止更新用户数据")
                 return False
-            accounts = self.load_accounts(config_path)
-            updated = False
-            for acc in accounts:
-                data = acc.get("data", {})
-                acc_us = data.get("us")
-                if isinstance(acc_us, str):
-                    acc_us = acc_us.strip()
-                if acc.get("owner_id") == self.owner_id and acc_us == self.us:
-                    acc["data"].update({
-                        "us": self.us,
-                        "userId": str(self.user_id) if self.user_id else None,
-                        "passToken": self.pass_token,
-                        "securityToken": self.security_token
-                    })
-                    updated = True
-                    break
-            if not updated:
-                new_account = {
-                    "owner_id": self.owner_id,
-                    "data": {
-                        "us": self.us,
-                        "userId": str(self.user_id) if self.user_id else None,
-                        "passToken": self.pass_token,
-                        "securityToken": self.security_token
+            # 与 xiaomi.py 写回执行日志使用同一把文件锁，读-改-写期间不会互相覆盖
+            with jsoncodec.file_lock(config_path):
+                accounts = self.load_accounts(config_path)
+                updated = False
+                for acc in accounts:
+                    data = acc.get("data", {})
+                    acc_us = data.get("us")
+                    if isinstance(acc_us, str):
+                        acc_us = acc_us.strip()
+                    if acc.get("owner_id") == self.owner_id and acc_us == self.us:
+                        acc["data"].update({
+                            "us": self.us,
+                            "userId": str(self.user_id) if self.user_id else None,
+                            "passToken": self.pass_token,
+                            "securityToken": self.security_token
+                        })
+                        updated = True
+                        break
+                if not updated:
+                    new_account = {
+                        "owner_id": self.owner_id,
+                        "data": {
+                            "us": self.us,
+                            "userId": str(self.user_id) if self.user_id else None,
+                            "passToken": self.pass_token,
+                            "securityToken": self.security_token
+                        }
                     }
-                }
-                accounts.append(new_account)
-            if _should_stop:
-                print("收到终止信号，停止保存文件")
-                return False
-            with open(config_path, "w", encoding="utf-8") as f:
-                json.dump(accounts, f, indent=4, ensure_ascii=False)
+                    accounts.append(new_account)
+                if _should_stop:
+                    print("收到终止信号，停止保存文件")
+                    return False
+                # 原子替换，正在读取配置的进程仍读到完整的旧文件
+                jsoncodec.write_file(config_path, accounts, indent=True)
             print(f"✅ 账号 {self.us} 数据已更新/添加，owner_id={self.owner_id}")
             return True
         except Exception as e:
@@ -130,21 +133,22 @@ class XiaomiAccount:
         根据us删除指定账号（可选owner_id限制）。
         """
         try:
-            accounts = self.load_accounts(config_path)
-            new_accounts = []
-            deleted = False
-            for acc in accounts:
-                data = acc.get("data", {})
-                acc_us = data.get("us")
-                if isinstance(acc_us, str):
-                    acc_us = acc_us.strip()
-                if acc_us == self.us and acc.get("owner_id") == self.owner_id:
-                    deleted = True
-                    continue  # 跳过该账号
-                new_accounts.append(acc)
+            with jsoncodec.file_lock(config_path):
+                accounts = self.load_accounts(config_path)
+                new_accounts = []
+                deleted = False
+                for acc in accounts:
+                    data = acc.get("data", {})
+                    acc_us = data.get("us")
+                    if isinstance(acc_us, str):
+                        acc_us = acc_us.strip()
+                    if acc_us == self.us and acc.get("owner_id") == self.owner_id:
+                        deleted = True
+                        continue  # 跳过该账号
+                    new_accounts.append(acc)
+                if deleted:
+                    jsoncodec.write_file(config_path, new_accounts, indent=True)
             if deleted:
-                with open(config_path, "w", encoding="utf-8") as f:
-                    json.dump(new_accounts, f, indent=4, ensure_ascii=False)
                 print(f"✅ 已删除账号 us={self.us}")
                 return True
             else:
@@ -213,14 +217,15 @@ class XiaomiAccount:
                 print("收到终止信号，停止网络请求")
                 return None
             
-            response = requests.get(url, headers=headers, params=querystring, timeout=10)
+            with new_session() as session:
+                response = session.get(url, headers=headers, params=querystring, timeout=10)
             response.raise_for_status()
             
             # 处理特殊前缀
             response_text = response.text
             if "&&&START&&&" in response_text:
-                return json.loads(response_text.split("&&&START&&&", 1)[-1].strip())
-            return response.json()
+                return jsoncodec.loads(response_text.split("&&&START&&&", 1)[-1].strip())
+            return jsoncodec.loads(response.content)
         except:
             return None
 
@@ -260,6 +265,7 @@ class XiaomiAccount:
         }
         
         
+        session = new_session()
         while time.time() < end_time:
             # 检查终止标志
             if _should_stop:
@@ -278,11 +284,11 @@ class XiaomiAccount:
                     return None
                 
                 # 获取登录状态
-                response = requests.get(lp_url, timeout=10)
+                response = session.get(lp_url, timeout=10)
                 response_text = response.text
                 if "&&&START&&&" in response_text:
                     response_text = response_text.split("&&&START&&&", 1)[-1].strip()
-                result = json.loads(response_text)
+                result = jsoncodec.loads(response_text)
                 
                 # 获取状态码
                 status_code = result.get("code", -1)
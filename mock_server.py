@@ -0,0 +1,267 @@
+# 本地模拟的小米钱包活动服务，用于压测和离线调试 xiaomi.py，不会访问真实接口
+# 用法: python mock_server.py --port 8765 --latency 50 --error-rate 0.01 --no-chance-rate 0.1
+# 然后: XIAOMI_API_BASE=http://127.0.0.1:8765 XIAOMI_ACCOUNT_BASE=http://127.0.0.1:8765 python xiaomi.py
+# Telegram 推送: XIAOMI_TG_API_BASE=http://127.0.0.1:8765 TG_BOT_TOKEN=test python xiaomi.py --report digest
+
+import json
+import random
+import argparse
+import threading
+import time
+import uuid
+from datetime import datetime
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+NO_CHANCE = {'code': 10101, 'success': False, 'error': '没有机会了,请先完成任务'}
+LOGIN_PAGE = b'<html><head><title>\xe5\xb0\x8f\xe7\xb1\xb3\xe8\xb4\xa6\xe5\x8f\xb7</title></head><body>login</body></html>'
+
+
+class MockUser:
+    """单个模拟账号的状态：每日剩余次数、待领取的 userTaskId 和领奖记录"""
+
+    def __init__(self, daily_chances):
+        self.daily_chances = daily_chances
+        self.chances = daily_chances
+        self.day = datetime.now().strftime("%Y-%m-%d")
+        self.gold = random.randint(100, 3000)
+        self.pending = []
+        self.history = []
+
+    def refresh(self):
+        """跨天后重置每日次数"""
+        today = datetime.now().strftime("%Y-%m-%d")
+        if today != self.day:
+            self.day = today
+            self.chances = self.daily_chances
+            self.pending = []
+
+
+class MockActivityServer:
+    """
+    模拟 serviceLogin 和 generalActivity 系列接口，返回与线上结构一致的数据。
+    latency 为平均延迟秒数，error_rate 为返回 HTTP 500 的概率，
+    no_chance_rate 为 completeTask/luckDraw 额外返回 10101「没有机会了」的概率。
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.05, error_rate=0.0,
+                 no_chance_rate=0.0, daily_chances=2, verbose=False):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.no_chance_rate = no_chance_rate
+        self.daily_chances = daily_chances
+        self.verbose = verbose
+        self.users = {}
+        self.messages = []
+        self.request_count = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), MockHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.mock = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def user(self, key):
+        with self._lock:
+            user = self.users.get(key)
+            if user is None:
+                user = self.users[key] = MockUser(self.daily_chances)
+            user.refresh()
+            return user
+
+    # ---------- 接口实现 ----------
+    def service_login(self, cookies):
+        """登录跳转链的终点：passToken 有效时下发 cUserId 和 serviceToken"""
+        user_id = cookies.get('userId')
+        if not cookies.get('passToken') or not user_id:
+            return 200, {}, LOGIN_PAGE
+        set_cookies = {
+            'cUserId': f"c{user_id}",
+            'serviceToken': f"st-{user_id}-{uuid.uuid4().hex[:16]}",
+        }
+        return 200, set_cookies, b'{"code":0,"desc":"success"}'
+
+    def send_message(self, payload):
+        """Telegram Bot API sendMessage，记录发出的消息"""
+        text = payload.get('text') or ''
+        if len(text.encode('utf-16-le')) // 2 > 4096:
+            return {'ok': False, 'error_code': 400, 'description': 'Bad Request: message is too long'}
+        with self._lock:
+            self.messages.append(payload)
+        return {'ok': True, 'result': {'message_id': len(self.messages), 'chat': {'id': payload.get('chat_id')}}}
+
+    def get_task_list(self, user, query):
+        tasks = [
+            {
+                'taskId': 1032,
+                'taskCode': 'BROWSE_VIDEO_01',
+                'taskName': '浏览组浏览任务',
+                'taskDesc': '浏览活动页面15秒',
+                'taskStatus': 1 if user.chances > 0 else 2,
+                'generalActivityUrlInfo': {'id': 3391, 'browsClickUrlId': 1215, 'url': 'https://m.jr.airstarfinance.net/mp/activity/videoActivity'},
+            },
+            {
+                'taskId': 1033,
+                'taskCode': 'SIGN_IN',
+                'taskName': '每日签到',
+                'taskStatus': 2,
+                'generalActivityUrlInfo': None,
+            },
+        ]
+        return {'code': 0, 'success': True, 'value': {'taskInfoList': tasks}}
+
+    def get_task(self, user, query):
+        user_task_id = user.pending[-1] if user.pending else None
+        return {'code': 0, 'success': True, 'value': {'taskInfo': {'userTaskId': user_task_id, 'taskCode': query.get('taskCode')}}}
+
+    def complete_task(self, user, query):
+        with self._lock:
+            if user.chances <= 0 or random.random() < self.no_chance_rate:
+                return NO_CHANCE
+            user.chances -= 1
+            user_task_id = random.randint(10 ** 8, 10 ** 9)
+            user.pending.append(user_task_id)
+        return {'code': 0, 'success': True, 'value': user_task_id}
+
+    def luck_draw(self, user, query):
+        try:
+            user_task_id = int(query.get('userTaskId'))
+        except (TypeError, ValueError):
+            return NO_CHANCE
+        with self._lock:
+            if user_task_id not in user.pending or random.random() < self.no_chance_rate:
+                return NO_CHANCE
+            user.pending.remove(user_task_id)
+            value = random.choice([25, 50])
+            user.gold += value
+            user.history.insert(0, {
+                'createTime': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                'value': str(value),
+                'prizeName': f'视频会员{value / 100:.2f}天',
+                'userTaskId': user_task_id,
+            })
+        return {'code': 0, 'success': True, 'value': {'prizeInfo': {'amount': str(value), 'prizeName': f'视频会员{value / 100:.2f}天'}}}
+
+    def query_gold_rich_sum(self, user, query):
+        return {'code': 0, 'success': True, 'value': str(user.gold)}
+
+    def query_join_list(self, user, query):
+        page_num = max(1, int(query.get('pageNum') or 1))
+        page_size = max(1, int(query.get('pageSize') or 20))
+        start = (page_num - 1) * page_size
+        page = user.history[start:start + page_size]
+        return {'code': 0, 'success': True, 'value': {'data': page, 'total': len(user.history), 'pageNum': page_num}}
+
+
+ENDPOINTS = {
+    'getTaskList': MockActivityServer.get_task_list,
+    'getTask': MockActivityServer.get_task,
+    'completeTask': MockActivityServer.complete_task,
+    'luckDraw': MockActivityServer.luck_draw,
+    'queryUserGoldRichSum': MockActivityServer.query_gold_rich_sum,
+    'queryUserJoinList': MockActivityServer.query_join_list,
+}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.mock.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def _handle(self):
+        mock = self.server.mock
+        with mock._lock:
+            mock.request_count += 1
+        parts = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8', 'replace') if length else ''
+        if body and not self.headers.get('Content-Type', '').startswith('application/json'):
+            query.update({k: v[-1] for k, v in parse_qs(body).items()})
+        cookie = SimpleCookie()
+        cookie.load(self.headers.get('Cookie', ''))
+        cookies = {k: m.value for k, m in cookie.items()}
+
+        if mock.latency > 0:
+            time.sleep(random.uniform(mock.latency * 0.5, mock.latency * 1.5))
+        if random.random() < mock.error_rate:
+            return self._send(500, b'{"code":500,"error":"internal error"}')
+
+        endpoint = parts.path.rstrip('/').rsplit('/', 1)[-1]
+        if endpoint == 'serviceLogin':
+            status, set_cookies, body = mock.service_login(cookies)
+            return self._send(status, body, set_cookies)
+        if endpoint == 'sendMessage':
+            result = mock.send_message(json.loads(body or '{}'))
+            status = 200 if result['ok'] else result['error_code']
+            return self._send(status, json.dumps(result, ensure_ascii=False).encode('utf-8'))
+        handler = ENDPOINTS.get(endpoint)
+        if handler is None:
+            return self._send(404, b'{"code":404,"error":"not found"}')
+        c_user_id = cookies.get('cUserId')
+        if not c_user_id or c_user_id == 'None' or not cookies.get('jrairstar_serviceToken'):
+            # 未登录时线上会返回登录页
+            return self._send(200, LOGIN_PAGE, content_type='text/html; charset=utf-8')
+        # 每个账号在每个活动中的次数和记录相互独立
+        result = handler(mock, mock.user(f"{c_user_id}:{query.get('activityCode')}"), query)
+        self._send(200, json.dumps(result, ensure_ascii=False).encode('utf-8'))
+
+    def _send(self, status, body, set_cookies=None, content_type='application/json; charset=utf-8'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (set_cookies or {}).items():
+            self.send_header('Set-Cookie', f"{key}={value}; Path=/")
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="小米钱包活动接口本地模拟服务")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=50, help="平均响应延迟（毫秒），默认 50")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="返回 HTTP 500 的概率，默认 0")
+    parser.add_argument('--no-chance-rate', type=float, default=0.0, help="额外返回 10101「没有机会了」的概率，默认 0")
+    parser.add_argument('--daily-chances', type=int, default=2, help="每个账号每天可领取的次数，默认 2")
+    parser.add_argument('-v', '--verbose', action='store_true', help="打印每个请求")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    server = MockActivityServer(
+        host=args.host, port=args.port, latency=args.latency / 1000,
+        error_rate=args.error_rate, no_chance_rate=args.no_chance_rate,
+        daily_chances=args.daily_chances, verbose=args.verbose,
+    )
+    print(f"模拟服务运行中: {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -6,6 +6,8 @@ def install_requirements():
     requirements = [
         'asyncio',
         'requests',
+        'aiohttp',
+        'orjson',
     ]
     
     for package in requirements:
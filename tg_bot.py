@@ -2,7 +2,7 @@
 # 适用: 青龙面板
 # 注意：此脚本不自动运行，需手动执行
 
-import json
+import jsoncodec
 import datetime
 import os
 import asyncio
@@ -47,14 +47,14 @@ class AuthManager:
             return {}
         try:
             with open(self.auth_file, "r", encoding="utf-8") as f:
-                return json.load(f)
+                return jsoncodec.load(f)
         except:
             return {}
     
     def save_auth(self, data):
         """保存授权信息"""
         with open(self.auth_file, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+            jsoncodec.dump(data, f, indent=2)
     
     def get_expire_days(self, expire_str):
         """计算距离到期还有多少天"""
@@ -77,14 +77,14 @@ class LogManager:
             return {}
         try:
             with open(self.log_file, "r", encoding="utf-8") as f:
-                return json.load(f)
+                return jsoncodec.load(f)
         except:
             return {}
     
     def save_logs(self, data):
-        """保存日志数据"""
+        """保存日志数据（仅供程序读取，使用紧凑格式）"""
         with open(self.log_file, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+            jsoncodec.dump(data, f)
     
     def add_log(self, user_id, action, result, details=""):
         """添加日志记录"""
@@ -549,7 +549,7 @@ class BotCommands:
         user_id = update.effective_user.id
         try:
             with open("xiaomiconfig.json", "r", encoding="utf-8") as f:
-                accounts = json.load(f)
+                accounts = jsoncodec.load(f)
         except Exception as e:
             await update.message.reply_text(f"读取账号配置失败: {e}")
             return
@@ -618,7 +618,7 @@ class BotCommands:
         user_id = update.effective_user.id
         try:
             with open("xiaomiconfig.json", "r", encoding="utf-8") as f:
-                accounts = json.load(f)
+                accounts = jsoncodec.load(f)
         except Exception as e:
             await update.message.reply_text(f"读取账号配置失败: {e}")
             return
@@ -638,7 +638,7 @@ class BotCommands:
             await update.message.reply_text("你没有权限。"); return
         try:
             with open("xiaomiconfig.json", "r", encoding="utf-8") as f:
-                accounts = json.load(f)
+                accounts = jsoncodec.load(f)
         except Exception as e:
             await update.message.reply_text(f"读取账号配置失败: {e}")
             return
@@ -0,0 +1,8 @@
+
+# 进入xiaomi_daemon.py所在目录（请根据实际情况修改路径）
+# cron "@boot" script-path=xiaomi/watch_xiaomi_daemon.sh, tag=xiaomi常驻进程守护
+# 适用: 青龙面板
+cd "$(dirname "$0")"
+
+# 检查xiaomi_daemon.py是否在运行，如果没有则启动
+pgrep -f "python3 xiaomi_daemon.py" > /dev/null || nohup python3 xiaomi_daemon.py > xiaomi_daemon.log 2>&1 &
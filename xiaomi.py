@@ -3,13 +3,38 @@
 # 适用: 青龙面板
 
 import os
+import math
 import time
 import random
+import asyncio
+import inspect
+import argparse
+import threading
+import re
 import requests
 import urllib3
-from datetime import datetime
+from requests.adapters import HTTPAdapter
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
 from typing import Optional, Dict, Any, Union
-import json
+import zlib
+import heapq
+import itertools
+import socket
+import sqlite3
+
+try:
+    # 异步引擎依赖 aiohttp，未安装时仍可使用默认的线程引擎
+    import aiohttp
+    from yarl import URL
+except ImportError:
+    aiohttp = None
+import jsoncodec
+from jsoncodec import file_lock
+from cassette import new_session
 # from notify import send
 
 
@@ -22,16 +47,404 @@ import json
 # import sendNotify
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# 接口地址，压测时可指向本地模拟服务（见 mock_server.py）
+API_BASE = os.environ.get('XIAOMI_API_BASE', 'https://m.jr.airstarfinance.net')
+ACCOUNT_BASE = os.environ.get('XIAOMI_ACCOUNT_BASE', 'https://account.xiaomi.com')
+# 任务停留时间的倍率，仅供压测缩短等待，正式运行请保持 1
+DWELL_SCALE = float(os.environ.get('XIAOMI_DWELL_SCALE', '1'))
+# 浏览任务每天可领取的奖励次数
+DAILY_TASK_LIMIT = int(os.environ.get('XIAOMI_DAILY_TASKS', '2'))
+# 「没有机会了,请先完成任务」
+NO_CHANCE_CODE = 10101
+# 登录态失效时接口返回的 HTTP 状态码或 code
+AUTH_EXPIRED_CODES = (401, 403)
+# 单次请求的超时秒数（连接和每次读取），防止一个卡住的连接拖住整轮执行
+REQUEST_TIMEOUT = float(os.environ.get('XIAOMI_REQUEST_TIMEOUT', '15'))
+
+
+# ========== 运行指标 ==========
+class Metrics:
+    """
+    进程内聚合的运行指标：各接口的延迟直方图、HTTP 状态码和业务 code，以及 RNL 各阶段的耗时。
+    只在内存中累加计数，运行结束时导出为 JSON 和 Prometheus 文本格式。
+    """
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (指标名, 标签值) -> [各桶计数..., 总次数, 总耗时]
+        self._histograms = {}
+        self.status_codes = Counter()
+        self.business_codes = Counter()
+
+    def reset(self) -> None:
+        """清空已累加的指标，常驻进程每轮开始时调用"""
+        with self._lock:
+            self._histograms = {}
+            self.status_codes = Counter()
+            self.business_codes = Counter()
+
+    def observe(self, name: str, label: str, seconds: float) -> None:
+        with self._lock:
+            hist = self._histograms.get((name, label))
+            if hist is None:
+                hist = self._histograms[(name, label)] = [0] * (len(self.BUCKETS) + 2)
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    hist[i] += 1
+                    break
+            hist[-2] += 1
+            hist[-1] += seconds
+
+    def record_request(self, endpoint: str, seconds: float, status, result=None) -> None:
+        """记录一次 HTTP 请求：耗时、状态码（连接失败为 error），以及响应中的业务 code"""
+        self.observe('request', endpoint, seconds)
+        with self._lock:
+            self.status_codes[(endpoint, str(status))] += 1
+            if isinstance(result, dict) and 'code' in result:
+                self.business_codes[(endpoint, str(result['code']))] += 1
+
+    @contextmanager
+    def phase(self, name: str):
+        """统计一个阶段的耗时，可以跨越步骤生成器中的 yield"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('phase', name, time.perf_counter() - start)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            histograms = {}
+            for (name, label), hist in sorted(self._histograms.items()):
+                histograms.setdefault(name, {})[label] = {
+                    'count': hist[-2],
+                    'sum': round(hist[-1], 6),
+                    'avg': round(hist[-1] / hist[-2], 6) if hist[-2] else 0,
+                    'buckets': dict(zip([str(b) for b in self.BUCKETS], hist[:len(self.BUCKETS)])),
+                }
+            return {
+                'requests': histograms.get('request', {}),
+                'phases': histograms.get('phase', {}),
+                'status_codes': {f"{e} {s}": n for (e, s), n in sorted(self.status_codes.items())},
+                'business_codes': {f"{e} {c}": n for (e, c), n in sorted(self.business_codes.items())},
+                'retries': dict(CIRCUIT_BREAKER.retries),
+                'breaker_trips': dict(CIRCUIT_BREAKER.trips),
+            }
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for name, label_name, help_text in (
+                    ('request', 'endpoint', '各接口请求耗时'),
+                    ('phase', 'phase', 'RNL 各阶段耗时'),
+            ):
+                metric = f"xiaomi_{name}_duration_seconds"
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} histogram")
+                for (hist_name, label), hist in sorted(self._histograms.items()):
+                    if hist_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(self.BUCKETS, hist):
+                        cumulative += count
+                        lines.append(f'{metric}_bucket{{{label_name}="{label}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{metric}_bucket{{{label_name}="{label}",le="+Inf"}} {hist[-2]}')
+                    lines.append(f'{metric}_sum{{{label_name}="{label}"}} {hist[-1]:.6f}')
+                    lines.append(f'{metric}_count{{{label_name}="{label}"}} {hist[-2]}')
+            counters = (
+                ('xiaomi_requests_total', 'HTTP 状态码计数', ('endpoint', 'status'), self.status_codes),
+                ('xiaomi_business_code_total', '响应业务 code 计数', ('endpoint', 'code'), self.business_codes),
+                ('xiaomi_request_retries_total', '请求重试次数', ('endpoint',), CIRCUIT_BREAKER.retries),
+                ('xiaomi_breaker_trips_total', '熔断次数', ('endpoint',), CIRCUIT_BREAKER.trips),
+            )
+            for metric, help_text, label_names, counter in counters:
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} counter")
+                for key, count in sorted(counter.items()):
+                    values = key if isinstance(key, tuple) else (key,)
+                    labels = ",".join(f'{n}="{v}"' for n, v in zip(label_names, values))
+                    lines.append(f"{metric}{{{labels}}} {count}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, directory: str = ".", suffix: str = "") -> None:
+        """把指标写入 directory 下的 xiaomi_metrics.json 和 xiaomi_metrics.prom，suffix 不为空时加在扩展名前"""
+        name = f"xiaomi_metrics.{suffix}" if suffix else "xiaomi_metrics"
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, f"{name}.json"), "wb") as f:
+                f.write(jsoncodec.dumpb(self.to_dict()))
+            with open(os.path.join(directory, f"{name}.prom"), "w", encoding="utf-8") as f:
+                f.write(self.to_prometheus())
+        except Exception as e:
+            print(f"写入运行指标失败: {e}")
+
+
+METRICS = Metrics()
+
+
+# ========== 重试与熔断 ==========
+def endpoint_of(url: str) -> str:
+    """取 URL 路径的最后一段作为接口名，如 getTaskList / luckDraw"""
+    return urlsplit(url).path.rstrip('/').rsplit('/', 1)[-1]
+
+
+def is_retryable_status(status: Optional[int]) -> bool:
+    """限流和服务端错误可以重试，其余 4xx 重试也不会成功"""
+    return status is not None and (status == 429 or status >= 500)
+
+
+class RetryPolicy:
+    """单个接口的重试策略：最多 attempts 次，指数退避并加全抖动"""
+
+    def __init__(self, attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8.0):
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+def load_retry_policies(spec: str, base_delay: float) -> Dict[str, RetryPolicy]:
+    """
+    解析形如 "completeTask=2,luckDraw=2,*=3" 的重试次数配置，* 为其余接口的默认值。
+    领奖类接口默认少重试几次，避免在服务端已处理的情况下反复提交。
+    """
+    attempts = {
+        'getTaskList': 3,
+        'getTask': 3,
+        'completeTask': 2,
+        'luckDraw': 2,
+        'queryUserJoinList': 3,
+        'queryUserGoldRichSum': 3,
+        '*': 2,
+    }
+    for item in spec.split(','):
+        if '=' in item:
+            name, value = item.split('=', 1)
+            if value.strip().isdigit():
+                attempts[name.strip()] = int(value)
+    return {name: RetryPolicy(count, base_delay) for name, count in attempts.items()}
+
+
+RETRY_POLICIES = load_retry_policies(
+    os.environ.get('XIAOMI_RETRY', ''),
+    float(os.environ.get('XIAOMI_RETRY_BACKOFF', '0.5')),
+)
+
+
+def retry_policy_for(endpoint: str) -> RetryPolicy:
+    return RETRY_POLICIES.get(endpoint) or RETRY_POLICIES['*']
+
+
+class CircuitBreaker:
+    """
+    所有账号共享的熔断器：按接口统计最近 window 次请求的失败率，
+    样本数达到 min_requests 且失败率超过 threshold 时熔断，整个运行暂停 cooldown 秒后再放行。
+    同时记录各接口的重试次数和熔断次数。
+    """
+
+    def __init__(self, window: int = 50, threshold: float = 0.5, min_requests: int = 20, cooldown: float = 30):
+        self.window = window
+        self.threshold = threshold
+        self.min_requests = min_requests
+        self.cooldown = cooldown
+        self.retries = Counter()
+        self.trips = Counter()
+        self._outcomes = {}
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    def reset(self) -> None:
+        """清空失败率样本、重试和熔断次数，并解除熔断"""
+        with self._lock:
+            self.retries = Counter()
+            self.trips = Counter()
+            self._outcomes = {}
+            self._open_until = 0.0
+
+    def wait_time(self) -> float:
+        """熔断期间返回剩余暂停秒数，否则返回 0"""
+        return max(0.0, self._open_until - time.monotonic())
+
+    def record(self, endpoint: str, ok: bool) -> None:
+        with self._lock:
+            outcomes = self._outcomes.setdefault(endpoint, deque(maxlen=self.window))
+            outcomes.append(ok)
+            if len(outcomes) < self.min_requests or self.wait_time() > 0:
+                return
+            error_rate = outcomes.count(False) / len(outcomes)
+            if error_rate > self.threshold:
+                self._open_until = time.monotonic() + self.cooldown
+                self.trips[endpoint] += 1
+                outcomes.clear()
+                print(f"[Circuit Open] {endpoint} 失败率 {error_rate:.0%}，暂停所有请求 {self.cooldown:.0f} 秒")
+
+    def count_retry(self, endpoint: str) -> None:
+        with self._lock:
+            self.retries[endpoint] += 1
+
+    def summary(self) -> str:
+        if not self.retries and not self.trips:
+            return ""
+        parts = [f"{name} 重试{self.retries[name]}次/熔断{self.trips[name]}次"
+                 for name in sorted(set(self.retries) | set(self.trips))]
+        return "🔁 请求重试：" + "，".join(parts)
+
+
+CIRCUIT_BREAKER = CircuitBreaker(
+    threshold=float(os.environ.get('XIAOMI_BREAKER_THRESHOLD', '0.5')),
+    cooldown=float(os.environ.get('XIAOMI_BREAKER_COOLDOWN', '30')),
+)
+
+
+# ========== 限流 ==========
+class TokenBucket:
+    """令牌桶：每秒补充 rate 个令牌，最多积攒 burst 个；令牌可以预支，返回需要等待的秒数"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+
+class HostRateLimiter:
+    """
+    按上游域名限流，所有账号的请求（线程和协程）都经过同一个实例。
+    未配置的域名不限流；queue_depth() 返回当前正在排队等待令牌的请求数。
+    """
+
+    def __init__(self, limits: Dict[str, tuple]):
+        self._buckets = {host: TokenBucket(rate, burst) for host, (rate, burst) in limits.items() if rate > 0}
+        self._waiting = Counter()
+        self.peak_depth = Counter()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_spec(cls, spec: str) -> 'HostRateLimiter':
+        """解析形如 "m.jr.airstarfinance.net=20:40,account.xiaomi.com=5:10" 的配置（域名=每秒请求数:突发数）"""
+        limits = {}
+        for item in spec.split(','):
+            if '=' not in item:
+                continue
+            host, value = item.split('=', 1)
+            rate, _, burst = value.partition(':')
+            try:
+                limits[host.strip()] = (float(rate), float(burst or rate))
+            except ValueError:
+                print(f"忽略无法解析的限流配置: {item}")
+        return cls(limits)
+
+    def reset(self) -> None:
+        """清空排队峰值统计，令牌桶照常按时间补充"""
+        with self._lock:
+            self.peak_depth = Counter()
+
+    def _reserve(self, url: str):
+        host = urlsplit(url).hostname
+        bucket = self._buckets.get(host)
+        return host, bucket.reserve() if bucket else 0.0
+
+    def _enter(self, host):
+        with self._lock:
+            self._waiting[host] += 1
+            self.peak_depth[host] = max(self.peak_depth[host], self._waiting[host])
+
+    def _leave(self, host):
+        with self._lock:
+            self._waiting[host] -= 1
+
+    def acquire(self, url: str) -> None:
+        host, wait = self._reserve(url)
+        if wait > 0:
+            self._enter(host)
+            try:
+                time.sleep(wait)
+            finally:
+                self._leave(host)
+
+    async def acquire_async(self, url: str) -> None:
+        host, wait = self._reserve(url)
+        if wait > 0:
+            self._enter(host)
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self._leave(host)
+
+    def queue_depth(self, host: Optional[str] = None) -> int:
+        with self._lock:
+            return self._waiting[host] if host else sum(self._waiting.values())
+
+    def summary(self) -> str:
+        if not self.peak_depth:
+            return ""
+        parts = [f"{host} 最多排队{depth}个" for host, depth in sorted(self.peak_depth.items())]
+        return "🚦 限流排队：" + "，".join(parts)
+
+
+RATE_LIMITER = HostRateLimiter.from_spec(
+    os.environ.get('XIAOMI_RATE_LIMITS', 'm.jr.airstarfinance.net=20:40,account.xiaomi.com=5:10')
+)
+
+
+class AccountTimeout(Exception):
+    """账号执行超过时间预算"""
+
+
+class _LoginRequired:
+    """接口返回了登录页或 401/403：与 None 一样为假，调用方可据此区分登录态失效和网络错误"""
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return '登录页（登录态已失效）'
+
+
+LOGIN_REQUIRED = _LoginRequired()
+
+
+def is_login_page(content_type):
+    return (content_type or '').startswith('text/html')
+
 
 class RnlRequest:
-    def __init__(self, cookies: Union[str, dict]):
-        self.session = requests.Session()
-        self._base_headers = {
-            'Host': 'm.jr.airstarfinance.net',
-            'User-Agent': 'Mozilla/5.0 (Linux; U; Android 14; zh-CN; M2012K11AC Build/UKQ1.230804.001; AppBundle/com.mipay.wallet; AppVersionName/6.89.1.5275.2323; AppVersionCode/20577595; MiuiVersion/stable-V816.0.13.0.UMNCNXM; DeviceId/alioth; NetworkType/WIFI; mix_version; WebViewVersion/118.0.0.0) AppleWebKit/537.36 (KHTML, like Gecko) Version/4.0 Mobile Safari/537.36 XiaoMi/MiuiBrowser/4.3',
-        }
+    BASE_HEADERS = {
+        'Host': 'm.jr.airstarfinance.net',
+        'User-Agent': 'Mozilla/5.0 (Linux; U; Android 14; zh-CN; M2012K11AC Build/UKQ1.230804.001; AppBundle/com.mipay.wallet; AppVersionName/6.89.1.5275.2323; AppVersionCode/20577595; MiuiVersion/stable-V816.0.13.0.UMNCNXM; DeviceId/alioth; NetworkType/WIFI; mix_version; WebViewVersion/118.0.0.0) AppleWebKit/537.36 (KHTML, like Gecko) Version/4.0 Mobile Safari/537.36 XiaoMi/MiuiBrowser/4.3',
+    }
+
+    def __init__(self, cookies: Union[str, dict], adapter: Optional[HTTPAdapter] = None,
+                 timeout: float = REQUEST_TIMEOUT):
+        self.session = new_session(adapter)
+        self._base_headers = dict(self.BASE_HEADERS)
+        self.timeout = timeout
+        # 账号的截止时间（time.monotonic），每次请求的超时都不会超过剩余时间
+        self.deadline = None
         self.update_cookies(cookies)
 
+    def _timeout(self, timeout=None):
+        """本次请求的超时秒数：取请求超时和账号剩余时间中较小的一个"""
+        timeout = timeout or self.timeout
+        if self.deadline is not None:
+            remaining = self.deadline - time.monotonic()
+            if remaining <= 0:
+                raise AccountTimeout("超出账号时间预算")
+            timeout = min(timeout, remaining) if timeout else remaining
+        return timeout
+
     def request(
             self,
             method: str,
@@ -42,25 +455,54 @@ class RnlRequest:
             **kwargs
     ) -> Optional[Dict[str, Any]]:
         headers = {**self._base_headers, **kwargs.pop('headers', {})}
-        try:
-            resp = self.session.request(
-                verify=False,
-                method=method.upper(),
-                url=url,
-                params=params,
-                data=data,
-                json=json,
-                headers=headers,
-                **kwargs
-            )
-            resp.raise_for_status()
-            return resp.json()
-        except requests.RequestException as e:
-            print(f"[Request Error] {e}")
-            return None
-        except ValueError as e:
-            print(f"[JSON Parse Error] {e}")
-            return None
+        request_timeout = kwargs.pop('timeout', None)
+        endpoint = endpoint_of(url)
+        policy = retry_policy_for(endpoint)
+        for attempt in range(policy.attempts):
+            pause = CIRCUIT_BREAKER.wait_time()
+            if pause > 0:
+                time.sleep(pause)
+            RATE_LIMITER.acquire(url)
+            timeout = self._timeout(request_timeout)
+            start = time.perf_counter()
+            resp = None
+            try:
+                resp = self.session.request(
+                    verify=False,
+                    method=method.upper(),
+                    url=url,
+                    params=params,
+                    data=data,
+                    json=json,
+                    headers=headers,
+                    timeout=timeout,
+                    **kwargs
+                )
+                resp.raise_for_status()
+                result = jsoncodec.loads(resp.content)
+                METRICS.record_request(endpoint, time.perf_counter() - start, resp.status_code, result)
+                CIRCUIT_BREAKER.record(endpoint, True)
+                return result
+            except requests.RequestException as e:
+                CIRCUIT_BREAKER.record(endpoint, False)
+                status = e.response.status_code if e.response is not None else None
+                METRICS.record_request(endpoint, time.perf_counter() - start, status or 'error')
+                retryable = isinstance(e, (requests.ConnectionError, requests.Timeout)) or is_retryable_status(status)
+                if retryable and attempt + 1 < policy.attempts:
+                    CIRCUIT_BREAKER.count_retry(endpoint)
+                    print(f"[Request Retry] {endpoint} 第{attempt + 1}次失败：{e}")
+                    time.sleep(policy.delay(attempt))
+                    continue
+                print(f"[Request Error] {e}")
+                return LOGIN_REQUIRED if status in AUTH_EXPIRED_CODES else None
+            except ValueError as e:
+                METRICS.record_request(endpoint, time.perf_counter() - start, 'invalid_json')
+                CIRCUIT_BREAKER.record(endpoint, False)
+                print(f"[JSON Parse Error] {e}")
+                # 登录态失效时线上返回 HTML 登录页
+                if resp is not None and is_login_page(resp.headers.get('Content-Type')):
+                    return LOGIN_REQUIRED
+                return None
 
     def update_cookies(self, cookies: Union[str, dict]) -> None:
         if cookies:
@@ -93,15 +535,563 @@ class RnlRequest:
              json: Optional[Dict[str, Any]] = None, **kwargs) -> Optional[Dict[str, Any]]:
         return self.request('POST', url, data=data, json=json, **kwargs)
 
+    def close(self) -> None:
+        self.session.close()
+
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.session.close()
+        self.close()
+
+
+class AsyncRnlRequest(RnlRequest):
+    """
+    RnlRequest 的 asyncio 版本，get/post 同样返回解析后的 JSON 或 None。
+    所有账号共享同一个连接器（keep-alive 连接池 + DNS 缓存），
+    每个实例使用独立的 CookieJar，账号之间的 Cookie 互不影响。
+    """
+
+    def __init__(self, cookies: Union[str, dict], connector: 'aiohttp.TCPConnector',
+                 timeout: float = REQUEST_TIMEOUT):
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            connector_owner=False,
+            cookie_jar=aiohttp.CookieJar(unsafe=True),
+        )
+        self._base_headers = dict(self.BASE_HEADERS)
+        self.timeout = timeout
+        self.deadline = None
+        self.update_cookies(cookies)
+
+    async def request(
+            self,
+            method: str,
+            url: str,
+            params: Optional[Dict[str, Any]] = None,
+            data: Optional[Union[Dict[str, Any], str, bytes]] = None,
+            json: Optional[Dict[str, Any]] = None,
+            **kwargs
+    ) -> Optional[Dict[str, Any]]:
+        headers = {**self._base_headers, **kwargs.pop('headers', {})}
+        request_timeout = kwargs.pop('timeout', None)
+        endpoint = endpoint_of(url)
+        policy = retry_policy_for(endpoint)
+        for attempt in range(policy.attempts):
+            pause = CIRCUIT_BREAKER.wait_time()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            await RATE_LIMITER.acquire_async(url)
+            timeout = self._timeout(request_timeout)
+            start = time.perf_counter()
+            resp = None
+            try:
+                async with self.session.request(
+                        method=method.upper(),
+                        url=url,
+                        params=params,
+                        data=data,
+                        json=json,
+                        headers=headers,
+                        ssl=False,
+                        timeout=aiohttp.ClientTimeout(total=timeout),
+                        **kwargs
+                ) as resp:
+                    resp.raise_for_status()
+                    result = await resp.json(content_type=None, loads=jsoncodec.loads)
+                METRICS.record_request(endpoint, time.perf_counter() - start, resp.status, result)
+                CIRCUIT_BREAKER.record(endpoint, True)
+                return result
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                CIRCUIT_BREAKER.record(endpoint, False)
+                status = e.status if isinstance(e, aiohttp.ClientResponseError) else None
+                METRICS.record_request(endpoint, time.perf_counter() - start, status or 'error')
+                retryable = (isinstance(e, (aiohttp.ClientConnectionError, asyncio.TimeoutError))
+                             or is_retryable_status(status))
+                if retryable and attempt + 1 < policy.attempts:
+                    CIRCUIT_BREAKER.count_retry(endpoint)
+                    print(f"[Request Retry] {endpoint} 第{attempt + 1}次失败：{e}")
+                    await asyncio.sleep(policy.delay(attempt))
+                    continue
+                print(f"[Request Error] {e}")
+                return LOGIN_REQUIRED if status in AUTH_EXPIRED_CODES else None
+            except ValueError as e:
+                METRICS.record_request(endpoint, time.perf_counter() - start, 'invalid_json')
+                CIRCUIT_BREAKER.record(endpoint, False)
+                print(f"[JSON Parse Error] {e}")
+                # 登录态失效时线上返回 HTML 登录页
+                if resp is not None and is_login_page(resp.headers.get('Content-Type')):
+                    return LOGIN_REQUIRED
+                return None
+
+    def update_cookies(self, cookies: Union[str, dict]) -> None:
+        # Cookie 通过请求头发送，服务端下发的 Cookie 由本实例独立的 CookieJar 保存
+        if cookies:
+            if isinstance(cookies, str):
+                dict_cookies = self._parse_cookies(cookies)
+            else:
+                dict_cookies = cookies
+            self._base_headers['Cookie'] = self.dict_cookie_to_string(dict_cookies)
+
+    async def get(self, url: str, params: Optional[Dict[str, Any]] = None, **kwargs) -> Optional[Dict[str, Any]]:
+        return await self.request('GET', url, params=params, **kwargs)
+
+    async def post(self, url: str, data: Optional[Union[Dict[str, Any], str, bytes]] = None,
+                   json: Optional[Dict[str, Any]] = None, **kwargs) -> Optional[Dict[str, Any]]:
+        return await self.request('POST', url, data=data, json=json, **kwargs)
+
+    async def close(self) -> None:
+        await self.session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+def create_async_connector(limit: int = 100) -> 'aiohttp.TCPConnector':
+    """创建一次运行内所有账号共享的连接器：复用 keep-alive 连接并缓存 DNS 解析结果"""
+    return aiohttp.TCPConnector(
+        limit=limit,
+        ttl_dns_cache=3600,
+        keepalive_timeout=60,
+        ssl=False,
+    )
+
+
+# ========== 步骤驱动 ==========
+class Call:
+    """
+    步骤生成器中的一次调用。
+    生成器 yield Call 交给驱动器执行，执行结果再通过 send 送回生成器；
+    yield 数字则表示需要等待的秒数。同一套业务逻辑因此可以由同步或异步驱动器执行。
+    """
+    __slots__ = ('func', 'args', 'kwargs')
+
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+
+def run_until_sleep(steps):
+    """
+    同步推进步骤生成器，直到遇到等待或生成器结束。
+    返回 (是否结束, 等待秒数或生成器返回值)；等待结束后再次调用即可从断点继续。
+    """
+    value, error = None, None
+    while True:
+        try:
+            step = steps.throw(error) if error is not None else steps.send(value)
+        except StopIteration as e:
+            return True, e.value
+        value, error = None, None
+        if isinstance(step, Call):
+            try:
+                value = step.func(*step.args, **step.kwargs)
+            except Exception as e:
+                error = e
+        else:
+            return False, step
+
+
+def run_steps(steps):
+    """同步驱动步骤生成器，返回生成器的返回值"""
+    while True:
+        done, value = run_until_sleep(steps)
+        if done:
+            return value
+        time.sleep(value)
+
+
+async def run_steps_async(steps):
+    """在事件循环中驱动步骤生成器，Call 返回的协程会被 await，等待不占用线程"""
+    value, error = None, None
+    while True:
+        try:
+            step = steps.throw(error) if error is not None else steps.send(value)
+        except StopIteration as e:
+            return e.value
+        value, error = None, None
+        if isinstance(step, Call):
+            try:
+                value = step.func(*step.args, **step.kwargs)
+                if inspect.isawaitable(value):
+                    value = await value
+            except Exception as e:
+                error = e
+        else:
+            await asyncio.sleep(step)
+
+
+def with_deadline(steps, deadline):
+    """
+    包装步骤生成器：每一步之前检查截止时间（time.monotonic），
+    已超时或下一次等待会越过截止时间时关闭原生成器并抛出 AccountTimeout。
+    """
+    value, error = None, None
+    while True:
+        if time.monotonic() >= deadline:
+            steps.close()
+            raise AccountTimeout("超出账号时间预算")
+        try:
+            step = steps.throw(error) if error is not None else steps.send(value)
+        except StopIteration as e:
+            return e.value
+        value, error = None, None
+        if not isinstance(step, Call) and time.monotonic() + step >= deadline:
+            steps.close()
+            raise AccountTimeout("超出账号时间预算")
+        try:
+            value = yield step
+        except Exception as e:
+            error = e
+
+
+def overlap_steps(generators):
+    """
+    把多个步骤生成器合并为一个：Call 依次执行，等待互相重叠，
+    总耗时约为最长的一条而不是各条之和。返回与 generators 顺序一致的返回值列表。
+    """
+    generators = list(generators)
+    results = [None] * len(generators)
+    ready = deque((i, None, None) for i in range(len(generators)))
+    sleeping = []
+    try:
+        while ready or sleeping:
+            if not ready:
+                delay = sleeping[0][0] - time.monotonic()
+                if delay > 0:
+                    yield delay
+                now = time.monotonic()
+                while sleeping and sleeping[0][0] <= now:
+                    ready.append((heapq.heappop(sleeping)[1], None, None))
+                continue
+            i, value, error = ready.popleft()
+            steps = generators[i]
+            # 推进同一条生成器直到它需要等待或结束
+            while True:
+                try:
+                    step = steps.throw(error) if error is not None else steps.send(value)
+                except StopIteration as e:
+                    results[i] = e.value
+                    break
+                value, error = None, None
+                if not isinstance(step, Call):
+                    heapq.heappush(sleeping, (time.monotonic() + step, i))
+                    break
+                try:
+                    value = yield step
+                except Exception as e:
+                    error = e
+    finally:
+        for steps in generators:
+            steps.close()
+    return results
+
+
+# ========== 时间轮调度 ==========
+class TimerWheel:
+    """
+    哈希时间轮：每个槽位对应 tick 秒，转一圈为 tick * slots 秒，更长的等待记录剩余圈数。
+    挂入和到期都是 O(1)，数千个账号的等待只占用一个调度线程。
+    """
+
+    def __init__(self, tick=0.1, slots=512):
+        self.tick = tick
+        self._slots = [[] for _ in range(slots)]
+        self._cursor = 0
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def schedule(self, delay, item):
+        """delay 秒后到期（按 tick 向上取整，至少一个 tick）"""
+        ticks = max(1, math.ceil(delay / self.tick))
+        slot_count = len(self._slots)
+        with self._lock:
+            index = (self._cursor + ticks) % slot_count
+            self._slots[index].append([(ticks - 1) // slot_count, item])
+            self._size += 1
+
+    def advance(self):
+        """时间前进一个 tick，返回本槽位中已到期的条目"""
+        with self._lock:
+            self._cursor = (self._cursor + 1) % len(self._slots)
+            slot = self._slots[self._cursor]
+            due = [item for rounds, item in slot if rounds == 0]
+            if due:
+                slot[:] = [entry for entry in slot if entry[0] > 0]
+                self._size -= len(due)
+            for entry in slot:
+                entry[0] -= 1
+            return due
+
+
+class WheelScheduler:
+    """
+    时间轮调度器：账号的步骤生成器在少量工作线程上推进，遇到等待就挂到时间轮上并释放线程，
+    到期后再交给工作线程从断点继续。整轮耗时由服务端要求的停留时间决定，而不是账号数 × 停留时间。
+    """
+
+    def __init__(self, workers=8, max_active=500, tick=0.1):
+        self.workers = max(1, workers)
+        self.max_active = max(1, max_active)
+        self.wheel = TimerWheel(tick=tick)
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+
+    def run(self, jobs, on_error, queue=None):
+        """
+        jobs 为 (key, 步骤生成器工厂) 组成的可迭代对象（可以边读边产生），全部执行完后返回。
+        生成器工厂在账号真正开始时才调用；未捕获的异常交给 on_error(key, e) 处理。
+        queue 为由 job 组成的 FairQueue 时按它决定开始顺序，默认按 jobs 顺序。
+        """
+        queue = queue or FairQueue(jobs)
+        active = [0]
+
+        def admit(executor):
+            # 有账号结束时可能同时有多个用户解除并发上限，尽量补满 max_active
+            while True:
+                with self._lock:
+                    if active[0] >= self.max_active:
+                        return
+                    entry = queue.next()
+                    if entry is None:
+                        # 没有执行中的账号时不受并发上限影响，取不到即全部完成
+                        if active[0] == 0:
+                            self._finished.set()
+                        return
+                    active[0] += 1
+                executor.submit(resume, executor, entry, None)
+
+        def resume(executor, entry, steps):
+            key, factory = entry
+            try:
+                if steps is None:
+                    steps = factory()
+                done, value = run_until_sleep(steps)
+                if not done:
+                    self.wheel.schedule(value, (entry, steps))
+                    return
+            except Exception as e:
+                on_error(key, e)
+            queue.done(entry)
+            with self._lock:
+                active[0] -= 1
+            admit(executor)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            admit(executor)
+            next_tick = time.monotonic() + self.wheel.tick
+            while not self._finished.is_set():
+                self._finished.wait(max(0.0, next_tick - time.monotonic()))
+                # 每经过一个 tick 推进一格，调度线程落后时一次补齐
+                while next_tick <= time.monotonic():
+                    for entry, steps in self.wheel.advance():
+                        executor.submit(resume, executor, entry, steps)
+                    next_tick += self.wheel.tick
+
+
+# ========== 按用户公平调度 ==========
+class OwnerPolicy:
+    """
+    按 owner_id 公平调度的参数：weights 为各用户的权重（默认 1），
+    caps 为各用户同时执行的账号数上限，未单独设置的用户使用 default_cap，0 表示不限制。
+    """
+
+    def __init__(self, weights=None, caps=None, default_cap=0):
+        self.weights = {str(k): float(v) for k, v in (weights or {}).items()}
+        self.caps = {str(k): int(v) for k, v in (caps or {}).items()}
+        self.default_cap = default_cap
+
+    def weight(self, owner):
+        return self.weights.get(owner, 1.0)
+
+    def cap(self, owner):
+        return self.caps.get(owner, self.default_cap)
+
+    @staticmethod
+    def _parse_pairs(spec):
+        pairs, default = {}, None
+        for item in (spec or '').split(','):
+            item = item.strip()
+            if not item:
+                continue
+            owner, sep, value = item.rpartition('=')
+            if sep:
+                pairs[owner.strip()] = value.strip()
+            else:
+                default = value
+        return pairs, default
+
+    @classmethod
+    def from_spec(cls, weights='', caps=''):
+        """weights 如 "123=2,456=0.5"；caps 如 "4,123=8"（不带用户的一项为默认上限）"""
+        weight_pairs, _ = cls._parse_pairs(weights)
+        cap_pairs, default_cap = cls._parse_pairs(caps)
+        for owner, weight in weight_pairs.items():
+            if float(weight) <= 0:
+                raise ValueError(f"用户 {owner} 的权重应大于 0: {weight}")
+        return cls(weight_pairs, cap_pairs, int(default_cap or 0))
+
+
+class FairQueue:
+    """
+    待执行账号队列（线程安全）。按 owner_id 分组，每次在还有账号且未达到并发上限的用户之间
+    按权重平滑轮转（smooth weighted round-robin）取出一个，权重相同时即各用户轮流；
+    policy 为 None 时按原顺序依次取出，items 可以是边读边产生的迭代器，用到时才取下一个。
+    items 中的元素由 owner_of 取得所属用户，默认为 (序号, 账号)。
+    """
+
+    def __init__(self, items, policy=None, owner_of=None):
+        self.policy = policy
+        self.owner_of = owner_of or (lambda item: item[1].get('owner_id'))
+        self._lock = threading.Lock()
+        self._source = None
+        self._queues = {}
+        if policy:
+            for item in items:
+                self._queues.setdefault(self._owner(item), deque()).append(item)
+        else:
+            self._source = iter(items)
+        self._current = dict.fromkeys(self._queues, 0.0)
+        self._running = Counter()
+
+    def _owner(self, item):
+        return str(self.owner_of(item))
+
+    def next(self):
+        """取出下一个账号；没有剩余账号或剩余账号的用户都已达到并发上限时返回 None"""
+        with self._lock:
+            if self._source is not None:
+                return next(self._source, None)
+            best, total = None, 0.0
+            for owner, queue in self._queues.items():
+                if not queue:
+                    continue
+                cap = self.policy.cap(owner)
+                if cap > 0 and self._running[owner] >= cap:
+                    continue
+                weight = self.policy.weight(owner)
+                self._current[owner] += weight
+                total += weight
+                if best is None or self._current[owner] > self._current[best]:
+                    best = owner
+            if best is None:
+                return None
+            self._current[best] -= total
+            self._running[best] += 1
+            return self._queues[best].popleft()
+
+    def done(self, item):
+        """账号执行结束，释放所属用户的并发名额"""
+        if self._source is not None:
+            return
+        with self._lock:
+            self._running[self._owner(item)] -= 1
+
+
+# ========== 活动插件 ==========
+class Activity:
+    """
+    活动插件：声明活动代码、任务筛选条件和领取流程，由 RNL 对每个账号执行。
+    默认流程为 浏览停留 → completeTask →（未返回 userTaskId 时）getTask → luckDraw，
+    流程不同的活动继承后重写 select_tasks / claim_steps / format_total，再用 register_activity 注册。
+    """
+
+    def __init__(self, code, name=None, task_keyword='浏览组浏览任务', daily_limit=DAILY_TASK_LIMIT):
+        self.code = code
+        self.name = name or code
+        self.task_keyword = task_keyword
+        self.daily_limit = daily_limit
+
+    def select_tasks(self, task_list):
+        """从任务列表中筛选需要执行的任务"""
+        return [task for task in task_list if self.task_keyword in task['taskName']]
+
+    def format_total(self, value):
+        """queryUserGoldRichSum 返回值的展示文本"""
+        return f"{int(value) / 100:.2f}天"
+
+    def claim_steps(self, rnl, task):
+        """完成并领取一个任务（步骤生成器），10101 时置位 rnl.no_chance 后返回"""
+        try:
+            t_id = task['generalActivityUrlInfo']['id']
+            rnl.t_id = t_id
+        except:
+            t_id = rnl.t_id
+        task_id = task['taskId']
+        task_code = task['taskCode']
+        brows_click_url_id = task['generalActivityUrlInfo']['browsClickUrlId']
+
+        yield from rnl.dwell(13)
+
+        # 完成任务
+        with METRICS.phase('complete'):
+            user_task_id = yield from rnl.complete_task(
+                t_id=t_id,
+                task_id=task_id,
+                brows_click_urlId=brows_click_url_id,
+            )
+
+        if rnl.no_chance:
+            return
+        yield from rnl.dwell(2)
+
+        # 获取任务数据
+        if not user_task_id:
+            with METRICS.phase('complete'):
+                user_task_id = yield from rnl.get_task(task_code=task_code)
+            yield from rnl.dwell(2)
+
+        # 领取奖励
+        with METRICS.phase('award'):
+            yield from rnl.receive_award(
+                user_task_id=user_task_id
+            )
+        if rnl.no_chance:
+            return
+
+        yield from rnl.dwell(2)
+
+
+VIDEO_ACTIVITY = Activity('2211-videoWelfare', name='视频会员')
+ACTIVITIES = {VIDEO_ACTIVITY.code: VIDEO_ACTIVITY}
+
+
+def register_activity(activity):
+    """注册活动插件，之后可在 --activities 中按活动代码选用"""
+    ACTIVITIES[activity.code] = activity
+    return activity
+
+
+def parse_activities(spec):
+    """
+    解析逗号分隔的活动列表，第一个为主活动（结果按原格式展示）。
+    每项为已注册的活动代码，或 活动代码=任务名关键词（按默认流程执行的浏览类活动）。
+    """
+    activities = []
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        code, _, keyword = item.partition('=')
+        code = code.strip()
+        if keyword.strip():
+            activities.append(Activity(code, task_keyword=keyword.strip()))
+        elif code in ACTIVITIES:
+            activities.append(ACTIVITIES[code])
+        else:
+            activities.append(Activity(code))
+    return activities or [VIDEO_ACTIVITY]
 
 
 class RNL:
-    def __init__(self, c):
+    def __init__(self, c, rr=None, history=None, activity=None, catalog=None, ledger=None):
         self.t_id = None
         self.options = {
             "task_list": True,
@@ -110,31 +1100,48 @@ class RNL:
             "task_item": True,
             "UserJoin": True,
         }
-        self.activity_code = '2211-videoWelfare'
-        self.rr = RnlRequest(c)
+        self.activity = activity or VIDEO_ACTIVITY
+        self.activity_code = self.activity.code
+        # 各账号共享的当天任务目录（TaskCatalog），本账号的任务列表与之一致时后续轮次不再重新获取
+        self.catalog = catalog
+        # 与目录一致时保存的任务列表（静态部分），后续轮次使用这份快照
+        self.catalog_tasks = None
+        # 领奖记录（ClaimLedger），已领取或已失效的 userTaskId 不再请求 luckDraw
+        self.ledger = ledger
+        self.rr = rr if rr is not None else RnlRequest(c)
         self.current_user_id = None  # 存储当前处理的用户ID
         self.total_days = "未知"
         self.today_records = []
+        # 本地已同步的任务记录（新的在前），history 为 HistoryStore 时跨运行保存
+        self.history = history
+        self.history_records = None
+        # 本次运行成功领取的奖励数，为 0 时无需再次查询记录
+        self.claimed = 0
+        # completeTask/luckDraw 返回 10101 时置位，今天的次数已用完
+        self.no_chance = False
         self.error_info = ""
+        # 查询接口返回登录页或 401/403 时置位，使用缓存 Cookie 的账号据此重新登录
+        self.auth_failed = False
+        # 确认今天的奖励已领完（记录达到上限或接口返回 10101）时置位，当天再次运行可跳过该账号
+        self.done = False
 
     def get_task_list(self):
         data = {
             'activityCode': self.activity_code,
         }
         try:
-            response = self.rr.post(
-                'https://m.jr.airstarfinance.net/mp/api/generalActivity/getTaskList',
+            response = yield Call(
+                self.rr.post,
+                API_BASE + '/mp/api/generalActivity/getTaskList',
                 data=data,
             )
             if response and response['code'] != 0:
                 self.error_info = f"获取任务列表失败：{response}"
                 print(self.error_info)
                 return None
-            target_tasks = []
-            for task in response['value']['taskInfoList']:
-                if '浏览组浏览任务' in task['taskName']:
-                    target_tasks.append(task)
-            return target_tasks
+            return self.activity.select_tasks(response['value']['taskInfoList'])
+        except AccountTimeout:
+            raise
         except Exception as e:
             self.error_info = f'获取任务列表失败：{e}'
             print(self.error_info)
@@ -147,8 +1154,9 @@ class RNL:
                 'taskCode': task_code,
                 'jrairstar_ph': '98lj8puDf9Tu/WwcyMpVyQ==',
             }
-            response = self.rr.post(
-                'https://m.jr.airstarfinance.net/mp/api/generalActivity/getTask',
+            response = yield Call(
+                self.rr.post,
+                API_BASE + '/mp/api/generalActivity/getTask',
                 data=data,
             )
             if response and response['code'] != 0:
@@ -156,6 +1164,8 @@ class RNL:
                 print(self.error_info)
                 return None
             return response['value']['taskInfo']['userTaskId']
+        except AccountTimeout:
+            raise
         except Exception as e:
             self.error_info = f'获取任务信息失败：{e}'
             print(self.error_info)
@@ -163,127 +1173,241 @@ class RNL:
 
     def complete_task(self, task_id, t_id, brows_click_urlId):
         try:
-            response = self.rr.get(
-                f'https://m.jr.airstarfinance.net/mp/api/generalActivity/completeTask?activityCode={self.activity_code}&app=com.mipay.wallet&isNfcPhone=true&channel=mipay_indexicon_TVcard&deviceType=2&system=1&visitEnvironment=2&userExtra=%7B%22platformType%22:1,%22com.miui.player%22:%224.27.0.4%22,%22com.miui.video%22:%22v2024090290(MiVideo-UN)%22,%22com.mipay.wallet%22:%226.83.0.5175.2256%22%7D&taskId={task_id}&browsTaskId={t_id}&browsClickUrlId={brows_click_urlId}&clickEntryType=undefined&festivalStatus=0',
+            response = yield Call(
+                self.rr.get,
+                f'{API_BASE}/mp/api/generalActivity/completeTask?activityCode={self.activity_code}&app=com.mipay.wallet&isNfcPhone=true&channel=mipay_indexicon_TVcard&deviceType=2&system=1&visitEnvironment=2&userExtra=%7B%22platformType%22:1,%22com.miui.player%22:%224.27.0.4%22,%22com.miui.video%22:%22v2024090290(MiVideo-UN)%22,%22com.mipay.wallet%22:%226.83.0.5175.2256%22%7D&taskId={task_id}&browsTaskId={t_id}&browsClickUrlId={brows_click_urlId}&clickEntryType=undefined&festivalStatus=0',
             )
             if response and response['code'] != 0:
+                self.no_chance = response['code'] == NO_CHANCE_CODE
                 self.error_info = f'完成任务失败：{response}'
                 print(self.error_info)
                 return None
             return response['value']
+        except AccountTimeout:
+            raise
         except Exception as e:
             self.error_info = f'完成任务失败：{e}'
             print(self.error_info)
             return None
 
     def receive_award(self, user_task_id):
+        if not user_task_id:
+            self.error_info = '领取奖励失败：没有获取到 userTaskId'
+            print(self.error_info)
+            return False
+        if self.ledger:
+            status = self.ledger.status(self.history_id, user_task_id)
+            if status in (CLAIM_REDEEMED, CLAIM_INVALID):
+                print(f"userTaskId {user_task_id} 已{'领取' if status == CLAIM_REDEEMED else '失效'}，跳过领取")
+                return status == CLAIM_REDEEMED
+            # 先记为待确认再请求，进程中途退出时下次运行继续领取
+            self.ledger.record(self.history_id, user_task_id, CLAIM_PENDING)
         try:
-            response = self.rr.get(
-                f'https://m.jr.airstarfinance.net/mp/api/generalActivity/luckDraw?imei=&device=manet&appLimit=%7B%22com.qiyi.video%22:false,%22com.youku.phone%22:true,%22com.tencent.qqlive%22:true,%22com.hunantv.imgo.activity%22:true,%22com.cmcc.cmvideo%22:false,%22com.sankuai.meituan%22:true,%22com.anjuke.android.app%22:false,%22com.tal.abctimelibrary%22:false,%22com.lianjia.beike%22:false,%22com.kmxs.reader%22:true,%22com.jd.jrapp%22:false,%22com.smile.gifmaker%22:true,%22com.kuaishou.nebula%22:false%7D&activityCode={self.activity_code}&userTaskId={user_task_id}&app=com.mipay.wallet&isNfcPhone=true&channel=mipay_indexicon_TVcard&deviceType=2&system=1&visitEnvironment=2&userExtra=%7B%22platformType%22:1,%22com.miui.player%22:%224.27.0.4%22,%22com.miui.video%22:%22v2024090290(MiVideo-UN)%22,%22com.mipay.wallet%22:%226.83.0.5175.2256%22%7D'
+            response = yield Call(
+                self.rr.get,
+                f'{API_BASE}/mp/api/generalActivity/luckDraw?imei=&device=manet&appLimit=%7B%22com.qiyi.video%22:false,%22com.youku.phone%22:true,%22com.tencent.qqlive%22:true,%22com.hunantv.imgo.activity%22:true,%22com.cmcc.cmvideo%22:false,%22com.sankuai.meituan%22:true,%22com.anjuke.android.app%22:false,%22com.tal.abctimelibrary%22:false,%22com.lianjia.beike%22:false,%22com.kmxs.reader%22:true,%22com.jd.jrapp%22:false,%22com.smile.gifmaker%22:true,%22com.kuaishou.nebula%22:false%7D&activityCode={self.activity_code}&userTaskId={user_task_id}&app=com.mipay.wallet&isNfcPhone=true&channel=mipay_indexicon_TVcard&deviceType=2&system=1&visitEnvironment=2&userExtra=%7B%22platformType%22:1,%22com.miui.player%22:%224.27.0.4%22,%22com.miui.video%22:%22v2024090290(MiVideo-UN)%22,%22com.mipay.wallet%22:%226.83.0.5175.2256%22%7D'
             )
             if response and response['code'] != 0:
+                self.no_chance = response['code'] == NO_CHANCE_CODE
                 self.error_info = f'领取奖励失败：{response}'
                 print(self.error_info)
+                # 只有 10101 能确定这个 userTaskId 不会再领到，其他错误可能是暂时的，保持待确认下次继续领取
+                if self.ledger and self.no_chance:
+                    self.ledger.record(self.history_id, user_task_id, CLAIM_INVALID)
+                return False
+            if response:
+                self.claimed += 1
+                if self.ledger:
+                    self.ledger.record(self.history_id, user_task_id, CLAIM_REDEEMED)
+            return bool(response)
+        except AccountTimeout:
+            raise
         except Exception as e:
             self.error_info = f'领取奖励失败：{e}'
             print(self.error_info)
+            return False
+
+    def resume_claims(self):
+        """继续领取上次运行中完成了任务、但没有确认领奖结果的 userTaskId（步骤生成器）"""
+        if not self.ledger:
+            return
+        for user_task_id in self.ledger.pending(self.history_id):
+            print(f"继续领取上次未确认的奖励：userTaskId {user_task_id}")
+            with METRICS.phase('award'):
+                yield from self.receive_award(user_task_id)
+        # 上次其实已经领到时接口会返回失败，不影响本次的任务
+        self.no_chance = False
+        self.error_info = ""
 
     def queryUserJoinListAndQueryUserGoldRichSum(self):
         try:
-            total_res = self.rr.get(
-                'https://m.jr.airstarfinance.net/mp/api/generalActivity/queryUserGoldRichSum?app=com.mipay.wallet&deviceType=2&system=1&visitEnvironment=2&userExtra={"platformType":1,"com.miui.player":"4.27.0.4","com.miui.video":"v2024090290(MiVideo-UN)","com.mipay.wallet":"6.83.0.5175.2256"}&activityCode=2211-videoWelfare')
+            total_res = yield Call(
+                self.rr.get,
+                API_BASE + '/mp/api/generalActivity/queryUserGoldRichSum?app=com.mipay.wallet&deviceType=2&system=1&visitEnvironment=2&userExtra={"platformType":1,"com.miui.player":"4.27.0.4","com.miui.video":"v2024090290(MiVideo-UN)","com.mipay.wallet":"6.83.0.5175.2256"}&activityCode=' + self.activity_code)
             if not total_res or total_res['code'] != 0:
+                # 只有登录态失效才需要重新登录，网络错误和超时不算
+                self.auth_failed = total_res is LOGIN_REQUIRED or bool(total_res and total_res['code'] in AUTH_EXPIRED_CODES)
                 self.error_info = f'获取兑换视频天数失败：{total_res}'
                 print(self.error_info)
                 return False
-            self.total_days = f"{int(total_res['value']) / 100:.2f}天" if total_res else "未知"
+            self.total_days = self.activity.format_total(total_res['value']) if total_res else "未知"
+
+            return (yield from self.sync_history())
+        except AccountTimeout:
+            raise
+        except Exception as e:
+            self.error_info = f'获取任务记录失败：{e}'
+            print(self.error_info)
+            return False
+
+    def sync_history(self):
+        """
+        增量同步任务完成记录：从第一页向后翻页，遇到高水位（已同步的最新 createTime）之前的记录即停止，
+        新记录追加到本地历史；还没有历史时翻到今天之前的记录为止。
+        """
+        if self.history_records is None:
+            self.history_records = self.history.records(self.history_id) if self.history else []
+        watermark = self.history_records[0]['createTime'] if self.history_records else None
+        known = {history_key(r) for r in self.history_records if r['createTime'] == watermark}
+        current_date = datetime.now().strftime("%Y-%m-%d")
 
-            response = self.rr.get(
-                f'https://m.jr.airstarfinance.net/mp/api/generalActivity/queryUserJoinList?&userExtra=%7B%22platformType%22:1,%22com.miui.player%22:%224.27.0.4%22,%22com.miui.video%22:%22v2024090290(MiVideo-UN)%22,%22com.mipay.wallet%22:%226.83.0.5175.2256%22%7D&activityCode={self.activity_code}&pageNum=1&pageSize=20',
+        new_records = []
+        for page_num in range(1, HISTORY_MAX_PAGES + 1):
+            response = yield Call(
+                self.rr.get,
+                f'{API_BASE}/mp/api/generalActivity/queryUserJoinList?&userExtra=%7B%22platformType%22:1,%22com.miui.player%22:%224.27.0.4%22,%22com.miui.video%22:%22v2024090290(MiVideo-UN)%22,%22com.mipay.wallet%22:%226.83.0.5175.2256%22%7D&activityCode={self.activity_code}&pageNum={page_num}&pageSize={HISTORY_PAGE_SIZE}',
             )
             if not response or response['code'] != 0:
                 self.error_info = f'查询任务完成记录失败：{response}'
                 print(self.error_info)
                 return False
 
-            history_list = response['value']['data']
-            current_date = datetime.now().strftime("%Y-%m-%d")
+            page = response['value']['data'] or []
+            reached = False
+            for a in page:
+                record_time = a['createTime']
+                if watermark and record_time < watermark or not watermark and record_time[:10] < current_date:
+                    reached = True
+                    break
+                # 与高水位同一秒的记录可能已同步过
+                if history_key(a) in known:
+                    continue
+                new_records.append({k: a[k] for k in HISTORY_FIELDS if k in a})
+            if reached or len(page) < HISTORY_PAGE_SIZE:
+                break
 
-            # 清空记录
-            self.today_records = []
+        if new_records:
+            self.history_records = new_records + self.history_records
+            if self.history:
+                self.history.merge(self.history_id, new_records)
 
-            for a in history_list:
-                record_time = a['createTime']
-                record_date = record_time[:10]
-                if record_date == current_date:
-                    self.today_records.append({
-                        'createTime': record_time,
-                        'value': a['value']
-                    })
+        self.today_records = [
+            {'createTime': r['createTime'], 'value': r['value']}
+            for r in self.history_records
+            if r['createTime'][:10] == current_date
+        ]
+        return True
 
-            return True
-        except Exception as e:
-            self.error_info = f'获取任务记录失败：{e}'
-            print(self.error_info)
-            return False
+    @property
+    def history_id(self):
+        """本地历史中的键：主活动沿用 userId，其他活动加上活动代码"""
+        if self.activity_code == VIDEO_ACTIVITY.code:
+            return self.current_user_id
+        return f"{self.current_user_id}:{self.activity_code}"
 
-    def main(self):
-        if not self.queryUserJoinListAndQueryUserGoldRichSum():
-            return False
-        for i in range(2):
-            # 获取任务列表
-            tasks = self.get_task_list()
-            if not tasks:
-                return False
+    def summary(self):
+        """非主活动在通知中的结果"""
+        return {
+            'name': self.activity.name,
+            'total': self.total_days,
+            'today_records': list(self.today_records),
+            'error': self.error_info,
+        }
 
-            task = tasks[0]
-            try:
-                t_id = task['generalActivityUrlInfo']['id']
-                self.t_id = t_id
-            except:
-                t_id = self.t_id
-            task_id = task['taskId']
-            task_code = task['taskCode']
-            brows_click_url_id = task['generalActivityUrlInfo']['browsClickUrlId']
-
-            time.sleep(13)
-
-            # 完成任务
-            user_task_id = self.complete_task(
-                t_id=t_id,
-                task_id=task_id,
-                brows_click_urlId=brows_click_url_id,
-            )
+    @staticmethod
+    def is_claimable(task):
+        """任务列表中带 taskStatus 时，只有未完成（1）的任务还能领取"""
+        return task.get('taskStatus', 1) == 1
 
-            time.sleep(2)
+    def remaining_chances(self, tasks):
+        """按今天已领取的记录和任务列表推算还能领取的次数"""
+        if not tasks or not any(self.is_claimable(task) for task in tasks):
+            return 0
+        return max(0, self.activity.daily_limit - len(self.today_records))
 
-            # 获取任务数据
-            if not user_task_id:
-                user_task_id = self.get_task(task_code=task_code)
-                time.sleep(2)
+    def dwell(self, seconds):
+        """任务要求的停留等待（步骤生成器）"""
+        with METRICS.phase('dwell'):
+            yield seconds * DWELL_SCALE
 
-            # 领取奖励
-            self.receive_award(
-                user_task_id=user_task_id
-            )
+    def steps(self):
+        """
+        main 的步骤生成器版本：HTTP 请求以 Call 的形式 yield，等待以秒数的形式 yield，
+        由 run_steps / run_steps_async 驱动执行。
+        """
+        with METRICS.phase('history'):
+            if not (yield from self.queryUserJoinListAndQueryUserGoldRichSum()):
+                return False
+        yield from self.resume_claims()
+        # 获取任务列表
+        with METRICS.phase('task_list'):
+            tasks = yield from self.get_task_list()
+        if tasks is None:
+            return False
+        remaining = self.remaining_chances(tasks)
+        if remaining == 0:
+            print(f"今日已领取 {len(self.today_records)} 次，没有可领取的奖励，跳过任务")
+            self.done = len(self.today_records) >= self.activity.daily_limit
+            return True
 
-            time.sleep(2)
+        if self.catalog is not None and self.catalog.observe(self.activity_code, tasks):
+            # 保存本账号匹配上的列表，之后其他账号更新目录也不影响本账号
+            self.catalog_tasks = [catalog_entry(task) for task in tasks]
 
-        # 重新获取最新记录
-        self.queryUserJoinListAndQueryUserGoldRichSum()
+        self.no_chance = False
+        for i in range(remaining):
+            if i > 0 and self.catalog_tasks:
+                # 任务列表与当天的目录一致，直接使用匹配时的快照；实际已无次数时由 10101 结束
+                tasks = [dict(task) for task in self.catalog_tasks]
+            elif i > 0:
+                # 每轮重新获取任务列表，浏览链接 id 可能变化
+                with METRICS.phase('task_list'):
+                    tasks = yield from self.get_task_list()
+                if tasks is None:
+                    return False
+            claimable = [task for task in tasks if self.is_claimable(task)]
+            if not claimable:
+                break
+
+            yield from self.activity.claim_steps(self, claimable[0])
+            if self.no_chance:
+                break
+
+        # 领到奖励后才需要重新获取最新记录（增量同步）
+        if self.claimed:
+            with METRICS.phase('history'):
+                yield from self.queryUserJoinListAndQueryUserGoldRichSum()
+        self.done = self.no_chance or len(self.today_records) >= self.activity.daily_limit
         return True
 
+    def main(self):
+        return run_steps(self.steps())
+
 
-def get_xiaomi_cookies(pass_token, user_id):
-    session = requests.Session()
-    login_url = 'https://account.xiaomi.com/pass/serviceLogin?callback=https%3A%2F%2Fapi.jr.airstarfinance.net%2Fsts%3Fsign%3D1dbHuyAmee0NAZ2xsRw5vhdVQQ8%253D%26followup%3Dhttps%253A%252F%252Fm.jr.airstarfinance.net%252Fmp%252Fapi%252Flogin%253Ffrom%253Dmipay_indexicon_TVcard%2526deepLinkEnable%253Dfalse%2526requestUrl%253Dhttps%25253A%25252F%25252Fm.jr.airstarfinance.net%25252Fmp%25252Factivity%25252FvideoActivity%25253Ffrom%25253Dmipay_indexicon_TVcard%252526_noDarkMode%25253Dtrue%252526_transparentNaviBar%25253Dtrue%252526cUserId%25253Dusyxgr5xjumiQLUoAKTOgvi858Q%252526_statusBarHeight%25253D137&sid=jrairstar&_group=DEFAULT&_snsNone=true&_loginType=ticket'
+XIAOMI_LOGIN_URL = ACCOUNT_BASE + '/pass/serviceLogin?callback=https%3A%2F%2Fapi.jr.airstarfinance.net%2Fsts%3Fsign%3D1dbHuyAmee0NAZ2xsRw5vhdVQQ8%253D%26followup%3Dhttps%253A%252F%252Fm.jr.airstarfinance.net%252Fmp%252Fapi%252Flogin%253Ffrom%253Dmipay_indexicon_TVcard%2526deepLinkEnable%253Dfalse%2526requestUrl%253Dhttps%25253A%25252F%25252Fm.jr.airstarfinance.net%25252Fmp%25252Factivity%25252FvideoActivity%25253Ffrom%25253Dmipay_indexicon_TVcard%252526_noDarkMode%25253Dtrue%252526_transparentNaviBar%25253Dtrue%252526cUserId%25253Dusyxgr5xjumiQLUoAKTOgvi858Q%252526_statusBarHeight%25253D137&sid=jrairstar&_group=DEFAULT&_snsNone=true&_loginType=ticket'
+LOGIN_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/135.0.0.0 Safari/537.36 Edg/135.0.0.0'
+
+
+def get_xiaomi_cookies(pass_token, user_id, adapter=None, timeout=REQUEST_TIMEOUT):
+    session = new_session(adapter)
     headers = {
-        'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/135.0.0.0 Safari/537.36 Edg/135.0.0.0',
+        'user-agent': LOGIN_USER_AGENT,
         'cookie': f'passToken={pass_token}; userId={user_id};'
     }
 
     try:
-        session.get(url=login_url, headers=headers, verify=False)
+        RATE_LIMITER.acquire(XIAOMI_LOGIN_URL)
+        session.get(url=XIAOMI_LOGIN_URL, headers=headers, verify=False, timeout=timeout)
         cookies = session.cookies.get_dict()
         return f"cUserId={cookies.get('cUserId')};jrairstar_serviceToken={cookies.get('serviceToken')}"
     except Exception as e:
@@ -292,119 +1416,2008 @@ def get_xiaomi_cookies(pass_token, user_id):
         return None, error_msg
 
 
-def generate_notification(account_id, rnl_instance,us):
-    """生成格式化的通知消息"""
-    current_date = datetime.now().strftime("%Y-%m-%d")
-
-    msg = f"""
-【账号信息】
-
-✨ 账号：{us} ID:{account_id}
-📊 当前兑换视频天数：{rnl_instance.total_days}
+async def async_get_xiaomi_cookies(pass_token, user_id, connector, timeout=REQUEST_TIMEOUT):
+    """get_xiaomi_cookies 的异步版本，登录跳转链复用共享连接器中的连接"""
+    cookie_jar = aiohttp.CookieJar(unsafe=True)
+    cookie_jar.update_cookies(
+        {'passToken': pass_token or '', 'userId': user_id or ''},
+        URL(ACCOUNT_BASE + '/'),
+    )
+    try:
+        await RATE_LIMITER.acquire_async(XIAOMI_LOGIN_URL)
+        async with aiohttp.ClientSession(
+                connector=connector,
+                connector_owner=False,
+                cookie_jar=cookie_jar,
+                headers={'user-agent': LOGIN_USER_AGENT},
+        ) as session:
+            async with session.get(XIAOMI_LOGIN_URL, ssl=False, timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+                await resp.read()
+            cookies = {cookie.key: cookie.value for cookie in session.cookie_jar}
+        return f"cUserId={cookies.get('cUserId')};jrairstar_serviceToken={cookies.get('serviceToken')}"
+    except Exception as e:
+        error_msg = f"获取Cookie失败: {e}"
+        print(error_msg)
+        return None, error_msg
+
+
+def render_notification(account_id, us, total_days, today_records, error_info, current_date=None,
+                        activities=()):
+    """按账号执行结果渲染通知文本，activities 为主活动之外各活动的 RNL.summary()"""
+    current_date = current_date or datetime.now().strftime("%Y-%m-%d")
+
+    parts = [f"""
+【账号信息】
+
+✨ 账号：{us} ID:{account_id}
+📊 当前兑换视频天数：{total_days}
 
 📅 {current_date} 任务记录
-{"-" * 40}"""
+{"-" * 40}"""]
 
-    for record in rnl_instance.today_records:
+    for record in today_records:
         record_time = record["createTime"]
         days = int(record["value"]) / 100
-        msg += f"""
+        parts.append(f"""
 ⏰ {record_time}
-🎁 领到视频会员，+{days:.2f}天"""
+🎁 领到视频会员，+{days:.2f}天""")
 
-    if rnl_instance.error_info:
-        msg += f"""
-⚠️ 执行异常：{rnl_instance.error_info}"""
+    if error_info:
+        parts.append(f"""
+⚠️ 执行异常：{error_info}""")
 
-    msg += f"""
-{"=" * 40}"""
+    for activity in activities:
+        parts.append(f"""
+📌 {activity['name']}：{activity['total']}，今日领取 {len(activity['today_records'])} 次""")
+        if activity['error']:
+            parts.append(f"""
+⚠️ 执行异常：{activity['error']}""")
 
-    return msg
+    parts.append(f"""
+{"=" * 40}""")
 
+    return "".join(parts)
 
-if __name__ == "__main__":
-    # 多账号配置区 ##################################
-    try:
-        with open("xiaomiconfig.json", "r", encoding="utf-8") as f:
-            ORIGINAL_COOKIES = json.load(f)
-        assert isinstance(ORIGINAL_COOKIES, list), "配置文件格式错误，应为账号字典列表"
-    except Exception as e:
-        print(f"读取xiaomiconfig.json失败: {e}")
-        exit(1)
-    # 结束配置 ######################################
 
-    # 构建完整通知消息
-    full_notification = "📺【小米钱包任务执行结果】\n"
+def generate_notification(account_id, rnl_instance,us):
+    """生成格式化的通知消息"""
+    return render_notification(
+        account_id, us, rnl_instance.total_days, rnl_instance.today_records, rnl_instance.error_info,
+    )
+
 
-    cookie_list = []
-    if len(ORIGINAL_COOKIES) == 0:
-        print("没有账号")
-        exit(1)
-    for account in ORIGINAL_COOKIES:
+# ========== 执行结果 ==========
+class AccountResult:
+    """单个账号的结构化执行结果，账号完成后立即交给各个输出端，通知文本由它渲染"""
+    __slots__ = ('index', 'user_id', 'us', 'owner_id', 'total_days', 'today_records',
+                 'error', 'success', 'date', 'elapsed', 'activities')
+
+    def __init__(self, index, user_id, us, owner_id, total_days="未知", today_records=None,
+                 error="", success=False, date=None, elapsed=0.0, activities=None):
+        self.index = index
+        self.user_id = user_id
+        self.us = us
+        self.owner_id = owner_id
+        self.total_days = total_days
+        self.today_records = today_records or []
+        self.error = error
+        self.success = success
+        self.date = date or datetime.now().strftime("%Y-%m-%d")
+        self.elapsed = elapsed
+        self.activities = activities or []
+
+    @classmethod
+    def from_rnl(cls, index, account, rnl, success, elapsed=0.0, extra=()):
+        """rnl 为主活动，extra 为同一账号其他活动的 RNL"""
         data = account.get('data', {})
-        us = data.get('us')
-        owner_id = account.get('owner_id')
-        user_id = data.get('userId')
-        pass_token = data.get('passToken')
-        security_token = data.get('securityToken')
-        print(f"\n>>>>>>>>>> 正在处理账号 {us}id{user_id} <<<<<<<<<<")
-
-        # 获取Cookie - 兼容原函数返回值
-        cookie_result = get_xiaomi_cookies(pass_token, user_id)
-
-        # 处理返回结果
-        if isinstance(cookie_result, tuple):
-            new_cookie, error = cookie_result
+        return cls(
+            index=index,
+            user_id=data.get('userId'),
+            us=data.get('us'),
+            owner_id=account.get('owner_id'),
+            total_days=rnl.total_days,
+            today_records=list(rnl.today_records),
+            error=rnl.error_info,
+            success=success,
+            elapsed=elapsed,
+            activities=[r.summary() for r in extra],
+        )
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{name: data.get(name) for name in cls.__slots__ if name in data})
+
+    def render(self):
+        return render_notification(
+            self.user_id, self.us, self.total_days, self.today_records, self.error, self.date,
+            self.activities,
+        )
+
+
+class StdoutSink:
+    """
+    实时打印账号结果，并保持配置文件中的原始顺序：
+    前面的账号还没完成时先暂存后面的结果，只保留乱序到达的那一小部分。
+    """
+
+    def __init__(self, title="📺【小米钱包任务执行结果】"):
+        self.title = title
+        self._next = 0
+        self._waiting = {}
+
+    def emit(self, result):
+        if self.title:
+            print(self.title)
+            self.title = None
+        self._waiting[result.index] = result
+        while self._next in self._waiting:
+            print(self._waiting.pop(self._next).render())
+            self._next += 1
+
+    def close(self):
+        for index in sorted(self._waiting):
+            print(self._waiting[index].render())
+        self._waiting.clear()
+
+
+class JsonlSink:
+    """每完成一个账号追加一行 JSON，运行过程中即可查看已完成的部分"""
+
+    def __init__(self, path="xiaomi_report.jsonl"):
+        self.path = path
+        self._file = open(path, "w", encoding="utf-8")
+
+    def emit(self, result):
+        self._file.write(jsoncodec.dumps(result.to_dict()) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class OwnerGroupSink:
+    """按 owner_id 分组收集结果，运行结束时可写入 JSON 文件，也供按用户汇总通知使用"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.groups = {}
+
+    def emit(self, result):
+        self.groups.setdefault(result.owner_id, []).append(result)
+
+    def render(self, owner_id):
+        results = sorted(self.groups.get(owner_id, []), key=lambda r: r.index)
+        return "".join(r.render() for r in results)
+
+    def close(self):
+        if not self.path:
+            return
+        try:
+            data = {
+                str(owner_id): [r.to_dict() for r in sorted(results, key=lambda r: r.index)]
+                for owner_id, results in self.groups.items()
+            }
+            jsoncodec.write_file(self.path, data)
+        except Exception as e:
+            print(f"写入分组结果失败: {e}")
+
+
+class OwnerStatsSink:
+    """统计各用户账号的完成时间（从运行开始算起），用于观察调度是否公平"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.finished = {}
+
+    def emit(self, result):
+        self.finished.setdefault(result.owner_id, []).append(time.perf_counter() - self.start)
+
+    def close(self):
+        pass
+
+    def summary(self):
+        if len(self.finished) < 2:
+            return ""
+        lines = ["⏱️ 各用户完成时间（秒）："]
+        rows = sorted(self.finished.items(), key=lambda kv: max(kv[1]))
+        for owner_id, times in rows:
+            times = sorted(times)
+            p50 = times[(len(times) - 1) // 2]
+            lines.append(f"  {owner_id}: {len(times)} 个账号  首个 {times[0]:.1f}  中位 {p50:.1f}  最后 {times[-1]:.1f}")
+        return "\n".join(lines) + "\n"
+
+
+class CheckpointJournal:
+    """
+    检查点日志：每完成一个账号追加一行结果（紧凑 JSON），最多每 fsync_interval 秒 fsync 一次，
+    进程中途被杀时已完成的账号不会丢失。resume 为 True 时先读入上次未完成运行中今天成功的账号，
+    它们由 restored() 直接返回结果而不再执行；运行正常结束（completed 置位）后删除日志文件。
+    多个进程共用工作目录时各自使用不同的 path（见 run_suffix）。
+    """
+
+    def __init__(self, path, fsync_interval=5.0, resume=False):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.completed = False
+        self._restored = self._load() if resume else {}
+        if resume:
+            print(f"从检查点恢复：{len(self._restored)} 个账号已完成，跳过")
+        elif os.path.isfile(path):
+            print(f"上次运行未正常结束（{path}），本次重新执行全部账号；使用 --resume 可跳过已完成的账号")
+        self._file = open(path, "a" if resume else "w", encoding="utf-8")
+        self._last_sync = time.monotonic()
+
+    def _load(self):
+        restored = {}
+        if not os.path.isfile(self.path):
+            return restored
+        today = datetime.now().strftime("%Y-%m-%d")
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = jsoncodec.loads(line)
+                except ValueError:
+                    # 最后一行可能只写了一半
+                    continue
+                # 同一账号后写入的结果为准，失败的账号和之前某天的结果在恢复时重新执行
+                if record.get('success') and record.get('date') == today:
+                    restored[record['key']] = record
+                else:
+                    restored.pop(record['key'], None)
+        return restored
+
+    def restored(self, account, index):
+        """账号在上次运行中已成功完成时返回其结果（序号换成本次的序号），否则返回 None"""
+        record = self._restored.get(account_key(account))
+        if record is None:
+            return None
+        return AccountResult.from_dict({**record, 'index': index})
+
+    def emit(self, result):
+        key = account_key(result)
+        if result.success and key in self._restored:
+            return
+        self._file.write(jsoncodec.dumps({'key': key, **result.to_dict()}) + "\n")
+        self._file.flush()
+        if time.monotonic() - self._last_sync >= self.fsync_interval:
+            os.fsync(self._file.fileno())
+            self._last_sync = time.monotonic()
+
+    def close(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        if self.completed:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+class RunReport:
+    """把账号结果分发给各个输出端（线程安全），并累计成功/失败数"""
+
+    def __init__(self, sinks=None):
+        self.sinks = list(sinks or [])
+        self.success_count = 0
+        self.failure_count = 0
+        self._lock = threading.Lock()
+
+    def emit(self, result):
+        with self._lock:
+            if result.success:
+                self.success_count += 1
+            else:
+                self.failure_count += 1
+            for sink in self.sinks:
+                try:
+                    sink.emit(result)
+                except Exception as e:
+                    print(f"输出执行结果失败: {e}")
+
+    def close(self):
+        with self._lock:
+            for sink in self.sinks:
+                try:
+                    sink.close()
+                except Exception as e:
+                    print(f"关闭输出端失败: {e}")
+
+    def summary_text(self):
+        text = f"""
+📊 执行汇总：
+✅ 成功账号数：{self.success_count}
+⚠️ 失败账号数：{self.failure_count}
+"""
+        for sink in self.sinks:
+            if hasattr(sink, 'summary'):
+                text += sink.summary()
+        return text
+
+
+def build_report(kinds, suffix=''):
+    """
+    按名称创建输出端：stdout 实时打印 / jsonl 逐行写文件 / owner 按用户分组 / digest 按用户推送汇总。
+    suffix 为分片或队列进程的后缀（见 run_suffix），共用工作目录的各进程写入各自的报告文件。
+    """
+    sinks = []
+    for kind in kinds:
+        if kind == 'stdout':
+            sinks.append(StdoutSink())
+        elif kind == 'jsonl':
+            sinks.append(JsonlSink(suffixed(REPORT_JSONL_FILE, suffix)))
+        elif kind == 'owner':
+            sinks.append(OwnerGroupSink(suffixed(REPORT_OWNER_FILE, suffix)))
+        elif kind == 'digest':
+            sinks.append(DigestSink())
         else:
-            new_cookie = cookie_result
-            error = None
+            print(f"未知的输出方式: {kind}")
+    return RunReport(sinks)
+
+
+REPORT_JSONL_FILE = "xiaomi_report.jsonl"
+REPORT_OWNER_FILE = "xiaomi_report_by_owner.json"
+
+
+def suffixed(path, suffix):
+    """在扩展名前加上后缀，如 xiaomi_report.jsonl -> xiaomi_report.1of4.jsonl"""
+    if not suffix:
+        return path
+    base, ext = os.path.splitext(path)
+    return f"{base}.{suffix}{ext}"
+
+
+def run_suffix(args):
+    """
+    本进程输出文件（报告、运行指标、检查点）的后缀：分片运行为 k of n，队列模式再加上 worker id，
+    多个进程共用工作目录时不会互相覆盖；单进程运行时为空，文件名不变。
+    """
+    parts = []
+    if args.shard:
+        parts.append(f"{args.shard[0]}of{args.shard[1]}")
+    if args.queue:
+        parts.append(re.sub(r'[^\w.-]', '-', args.worker_id))
+    return '.'.join(parts)
+
+
+# ========== 按用户推送汇总 ==========
+# 与 tg_bot.py 使用同一个机器人，owner_id 即用户的 Telegram ID
+TG_BOT_TOKEN = os.environ.get('TG_BOT_TOKEN', '')
+TG_API_BASE = os.environ.get('XIAOMI_TG_API_BASE', 'https://api.telegram.org')
+# Telegram 单条消息上限为 4096 个 UTF-16 字符
+TG_MESSAGE_LIMIT = 4096
+DIGEST_OUTBOX_FILE = os.environ.get('XIAOMI_DIGEST_OUTBOX', 'xiaomi_digest_outbox.json')
+
+
+def _tg_len(text):
+    return len(text.encode('utf-16-le')) // 2
+
+
+def split_digest(header, blocks, limit=TG_MESSAGE_LIMIT):
+    """
+    把各账号的通知文本拼成不超过 limit 的若干条消息，尽量不拆开同一个账号；
+    单个账号的文本本身超长时按行、再按字符截断。拆成多条时标题后附带页码。
+    """
+    budget = limit - _tg_len(header) - 16
+    pieces = []
+    for block in blocks:
+        block = block.strip('\n')
+        while _tg_len(block) > budget:
+            cut = budget
+            while _tg_len(block[:cut]) > budget:
+                cut -= 1
+            newline = block.rfind('\n', 0, cut)
+            if newline > 0:
+                cut = newline
+            pieces.append(block[:cut])
+            block = block[cut:].lstrip('\n')
+        if block:
+            pieces.append(block)
+
+    bodies = []
+    for piece in pieces:
+        if bodies and _tg_len(bodies[-1]) + 2 + _tg_len(piece) <= budget:
+            bodies[-1] += '\n\n' + piece
+        else:
+            bodies.append(piece)
+    if len(bodies) <= 1:
+        return [f"{header}\n\n{bodies[0]}" if bodies else header]
+    title, _, rest = header.partition('\n')
+    return [
+        f"{title}（{i}/{len(bodies)}）" + (f"\n{rest}" if rest else "") + f"\n\n{body}"
+        for i, body in enumerate(bodies, 1)
+    ]
+
+
+class DigestOutbox:
+    """
+    未送达汇总消息的磁盘队列：发送失败的消息写入文件，下次运行时先补发。
+    超过 max_attempts 次或超过 max_age 秒仍未送达的消息直接丢弃。
+    """
+
+    def __init__(self, path=DIGEST_OUTBOX_FILE, max_attempts=10, max_age=3 * 86400):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.max_age = max_age
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return []
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                messages = jsoncodec.load(f)
+            return messages if isinstance(messages, list) else []
+        except Exception as e:
+            print(f"读取待发送通知失败: {e}")
+            return []
+
+    def take(self):
+        """取出全部待发送的消息并清空队列（多个进程同时运行时每条消息只会被一个进程取到）"""
+        with file_lock(self.path):
+            messages = self._load()
+            if messages:
+                jsoncodec.write_file(self.path, [])
+        now = time.time()
+        kept = [m for m in messages if now - m.get('created_at', now) <= self.max_age]
+        if len(kept) < len(messages):
+            print(f"丢弃 {len(messages) - len(kept)} 条过期的待发送通知")
+        return kept
+
+    def put(self, messages):
+        kept = [m for m in messages if m.get('attempts', 0) < self.max_attempts]
+        if len(kept) < len(messages):
+            print(f"丢弃 {len(messages) - len(kept)} 条多次发送失败的通知")
+        if not kept:
+            return
+        try:
+            with file_lock(self.path):
+                jsoncodec.write_file(self.path, self._load() + kept)
+        except Exception as e:
+            print(f"写入待发送通知失败: {e}")
+
+
+class TelegramSender:
+    """通过 Bot API 并发发送消息，安装了 aiohttp 时在事件循环中发送，否则在线程中使用 requests"""
+
+    def __init__(self, token, api_base=TG_API_BASE, concurrency=8, timeout=REQUEST_TIMEOUT, retries=3):
+        self.url = f"{api_base}/bot{token}/sendMessage"
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+
+    async def send_all(self, messages):
+        """发送 messages，返回需要稍后重试的消息；对方拒收（未与机器人对话、已屏蔽等）的消息不再重试"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        session = None
+        if aiohttp is not None:
+            session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+        async def send_one(message):
+            async with semaphore:
+                return await self._send(session, message)
+
+        try:
+            # 单条消息的意外异常只算这一条发送失败，不影响已送达的消息
+            results = await asyncio.gather(*(send_one(m) for m in messages), return_exceptions=True)
+        finally:
+            if session is not None:
+                await session.close()
+        failed = []
+        for message, ok in zip(messages, results):
+            if isinstance(ok, BaseException):
+                print(f"发送通知给 {message['owner_id']} 失败: {ok}")
+            if ok is not True:
+                failed.append(message)
+        return failed
+
+    async def _post(self, session, payload):
+        """返回 (HTTP 状态码, 响应 JSON)"""
+        if session is not None:
+            async with session.post(self.url, json=payload) as resp:
+                return resp.status, await resp.json(content_type=None)
+        resp = await asyncio.to_thread(requests.post, self.url, json=payload, timeout=self.timeout)
+        return resp.status_code, resp.json()
+
+    async def _send(self, session, message):
+        payload = {'chat_id': message['owner_id'], 'text': message['text'], 'disable_web_page_preview': True}
+        for attempt in range(self.retries):
+            try:
+                status, body = await self._post(session, payload)
+            except Exception as e:
+                print(f"发送通知给 {message['owner_id']} 失败: {e}")
+                await asyncio.sleep(2 ** attempt)
+                continue
+            if not isinstance(body, dict):
+                body = {'description': body}
+            if status == 200 and body.get('ok'):
+                return True
+            if status == 429:
+                # 触发频率限制时按 retry_after 等待后重试
+                retry_after = (body.get('parameters') or {}).get('retry_after', 1)
+                await asyncio.sleep(min(retry_after, 30))
+                continue
+            if status in (400, 403):
+                print(f"通知无法送达 {message['owner_id']}: {body.get('description')}")
+                return True
+            print(f"发送通知给 {message['owner_id']} 失败: HTTP {status} {body.get('description')}")
+            await asyncio.sleep(2 ** attempt)
+        return False
+
+
+class DigestSink(OwnerGroupSink):
+    """
+    按 owner_id 分组收集结果，运行结束时给每个用户发送一条汇总消息（超长时拆分），
+    而不是每个账号一条；发送失败的消息进入 DigestOutbox，下次运行时补发。
+    """
+
+    def __init__(self, token=TG_BOT_TOKEN, outbox=None, sender=None):
+        super().__init__()
+        self.token = token
+        self.outbox = outbox or DigestOutbox()
+        self.sender = sender or (TelegramSender(token) if token else None)
+
+    def messages(self):
+        created_at = time.time()
+        messages = []
+        for owner_id, results in self.groups.items():
+            if owner_id is None:
+                continue
+            results = sorted(results, key=lambda r: r.index)
+            success = sum(1 for r in results if r.success)
+            header = (f"📺【小米钱包任务汇总】{results[0].date}\n"
+                      f"✅ 成功 {success} 个 / ⚠️ 失败 {len(results) - success} 个")
+            for text in split_digest(header, [r.render() for r in results]):
+                messages.append({'owner_id': owner_id, 'text': text, 'attempts': 0, 'created_at': created_at})
+        return messages
+
+    def close(self):
+        if self.sender is None:
+            print("未设置 TG_BOT_TOKEN，跳过按用户推送汇总")
+            return
+        messages = self.outbox.take() + self.messages()
+        if not messages:
+            return
+        try:
+            failed = asyncio.run(self.sender.send_all(messages))
+        except Exception as e:
+            print(f"推送汇总失败: {e}")
+            failed = messages
+        for message in failed:
+            message['attempts'] = message.get('attempts', 0) + 1
+        self.outbox.put(failed)
+        print(f"按用户推送汇总：发送 {len(messages) - len(failed)} 条，待重试 {len(failed)} 条")
+
+
+# ========== Cookie 缓存 ==========
+COOKIE_CACHE_FILE = os.environ.get('XIAOMI_COOKIE_CACHE', 'xiaomi_cookie_cache.json')
+
+
+class CookieCache:
+    """
+    按 userId 缓存登录得到的 cUserId/jrairstar_serviceToken。
+    条目超过 ttl 秒即视为过期，超过 max_entries 时淘汰最早写入的条目；
+    运行期间只修改内存，调用 save() 时与磁盘上其他进程写入的条目合并后统一落盘。
+    """
+
+    def __init__(self, path=COOKIE_CACHE_FILE, ttl=72 * 3600, max_entries=10000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._touched = set()
+        self._entries = self._load()
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = jsoncodec.load(f)
+            return entries if isinstance(entries, dict) else {}
+        except Exception as e:
+            print(f"读取Cookie缓存失败: {e}")
+            return {}
+
+    @staticmethod
+    def is_valid_cookie(cookie):
+        """登录失败时 get_xiaomi_cookies 会返回值为 None 的 Cookie，不能缓存"""
+        return isinstance(cookie, str) and 'None' not in RnlRequest._parse_cookies(cookie).values()
+
+    def get(self, user_id):
+        if not user_id:
+            return None
+        with self._lock:
+            entry = self._entries.get(str(user_id))
+            if not entry:
+                return None
+            if time.time() - entry.get('saved_at', 0) > self.ttl:
+                del self._entries[str(user_id)]
+                self._touched.add(str(user_id))
+                self._dirty = True
+                return None
+            return entry.get('cookie')
+
+    def put(self, user_id, cookie):
+        if not user_id or not self.is_valid_cookie(cookie):
+            return
+        with self._lock:
+            self._entries[str(user_id)] = {'cookie': cookie, 'saved_at': time.time()}
+            self._touched.add(str(user_id))
+            self._dirty = True
+
+    def invalidate(self, user_id):
+        with self._lock:
+            if self._entries.pop(str(user_id), None) is not None:
+                self._touched.add(str(user_id))
+                self._dirty = True
+
+    def _prune(self, entries):
+        """清理过期条目，并在超出容量时按写入时间淘汰最旧的条目，返回是否有改动"""
+        now = time.time()
+        expired = [k for k, v in entries.items() if now - v.get('saved_at', 0) > self.ttl]
+        for key in expired:
+            del entries[key]
+        overflow = len(entries) - self.max_entries
+        if overflow > 0:
+            oldest = sorted(entries, key=lambda k: entries[k].get('saved_at', 0))
+            for key in oldest[:overflow]:
+                del entries[key]
+        return bool(expired) or overflow > 0
+
+    def evict(self):
+        with self._lock:
+            if self._prune(self._entries):
+                self._dirty = True
+
+    def save(self):
+        self.evict()
+        with self._lock:
+            if not self._dirty:
+                return
+            try:
+                with file_lock(self.path):
+                    # 只覆盖本进程改动过的条目，其他进程写入的条目保持不变
+                    entries = self._load()
+                    for key in self._touched:
+                        if key in self._entries:
+                            entries[key] = self._entries[key]
+                        else:
+                            entries.pop(key, None)
+                    self._prune(entries)
+                    jsoncodec.write_file(self.path, entries)
+                self._entries = entries
+                self._touched.clear()
+                self._dirty = False
+            except Exception as e:
+                print(f"写入Cookie缓存失败: {e}")
+
+
+# ========== 任务记录同步 ==========
+HISTORY_FILE = os.environ.get('XIAOMI_HISTORY_FILE', 'xiaomi_history.json')
+HISTORY_PAGE_SIZE = 20
+# 单次同步最多翻页数，防止接口分页异常时无限翻页
+HISTORY_MAX_PAGES = int(os.environ.get('XIAOMI_HISTORY_MAX_PAGES', '10'))
+HISTORY_FIELDS = ('createTime', 'value', 'prizeName', 'userTaskId')
+
+
+def history_key(record):
+    """用于识别同一秒内的不同记录"""
+    return tuple(str(record.get(k)) for k in HISTORY_FIELDS)
+
+
+class HistoryStore:
+    """
+    按 userId 保存已同步的任务完成记录（新的在前），第一条的 createTime 即高水位。
+    只保留最近 keep_days 天的记录；运行期间只修改内存，调用 save() 时与其他进程的改动合并后统一落盘。
+    """
+
+    def __init__(self, path=HISTORY_FILE, keep_days=30):
+        self.path = path
+        self.keep_days = keep_days
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._touched = set()
+        self._entries = self._load()
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = jsoncodec.load(f)
+            return entries if isinstance(entries, dict) else {}
+        except Exception as e:
+            print(f"读取任务记录失败: {e}")
+            return {}
+
+    def records(self, user_id):
+        with self._lock:
+            return list(self._entries.get(str(user_id), []))
+
+    def merge(self, user_id, new_records):
+        cutoff = (datetime.now() - timedelta(days=self.keep_days)).strftime("%Y-%m-%d")
+        with self._lock:
+            records = new_records + self._entries.get(str(user_id), [])
+            self._entries[str(user_id)] = [r for r in records if r['createTime'][:10] >= cutoff]
+            self._touched.add(str(user_id))
+            self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            try:
+                with file_lock(self.path):
+                    entries = self._load()
+                    for key in self._touched:
+                        entries[key] = self._entries[key]
+                    jsoncodec.write_file(self.path, entries)
+                self._entries = entries
+                self._touched.clear()
+                self._dirty = False
+            except Exception as e:
+                print(f"写入任务记录失败: {e}")
+
+
+# ========== 当日完成记录 ==========
+DONE_FILE = os.environ.get('XIAOMI_DONE_FILE', 'xiaomi_done.json')
+
+
+class DoneCache:
+    """
+    按 userId 记录当天已确认领完奖励的账号及其结果（兑换天数、当天记录），
+    同一天再次运行时直接按记录输出结果，不再登录和执行任务；只保留当天的条目。
+    """
+
+    def __init__(self, path=DONE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._touched = set()
+        self._entries = self._load()
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = jsoncodec.load(f)
+            return entries if isinstance(entries, dict) else {}
+        except Exception as e:
+            print(f"读取当日完成记录失败: {e}")
+            return {}
+
+    def get(self, user_id, codes=(VIDEO_ACTIVITY.code,)):
+        """返回账号今天的完成记录，没有、不是今天或没有覆盖 codes 中所有活动时返回 None"""
+        if not user_id:
+            return None
+        with self._lock:
+            entry = self._entries.get(str(user_id))
+        if not entry or entry.get('date') != datetime.now().strftime("%Y-%m-%d"):
+            return None
+        if not set(codes) <= set(entry.get('codes', [VIDEO_ACTIVITY.code])):
+            return None
+        return entry
+
+    def mark(self, result, codes=(VIDEO_ACTIVITY.code,)):
+        if not result.user_id:
+            return
+        with self._lock:
+            self._entries[str(result.user_id)] = {
+                'date': result.date,
+                'codes': list(codes),
+                'total_days': result.total_days,
+                'today_records': result.today_records,
+                'activities': result.activities,
+            }
+            self._touched.add(str(result.user_id))
+            self._dirty = True
+
+    def result(self, index, account, entry):
+        """由完成记录生成 AccountResult"""
+        data = account.get('data', {})
+        return AccountResult(
+            index, data.get('userId'), data.get('us'), account.get('owner_id'),
+            total_days=entry.get('total_days', "未知"),
+            today_records=entry.get('today_records'),
+            success=True,
+            date=entry.get('date'),
+            activities=entry.get('activities'),
+        )
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            try:
+                with file_lock(self.path):
+                    entries = self._load()
+                    for key in self._touched:
+                        entries[key] = self._entries[key]
+                    # 只保留当天的记录
+                    today = datetime.now().strftime("%Y-%m-%d")
+                    entries = {k: v for k, v in entries.items() if v.get('date') == today}
+                    jsoncodec.write_file(self.path, entries)
+                self._entries = entries
+                self._touched.clear()
+                self._dirty = False
+            except Exception as e:
+                print(f"写入当日完成记录失败: {e}")
+
+
+# ========== 任务目录缓存 ==========
+TASK_CATALOG_FILE = os.environ.get('XIAOMI_TASK_CATALOG', 'xiaomi_task_catalog.json')
+
+
+def catalog_entry(task):
+    """任务中各账号相同的静态部分，不含 taskStatus 等账号相关字段"""
+    url_info = task.get('generalActivityUrlInfo') or {}
+    return {
+        'taskId': task.get('taskId'),
+        'taskCode': task.get('taskCode'),
+        'taskName': task.get('taskName'),
+        'generalActivityUrlInfo': {'id': url_info.get('id'), 'browsClickUrlId': url_info.get('browsClickUrlId')},
+    }
+
+
+class TaskCatalog:
+    """
+    按活动代码缓存当天任务列表的静态部分（taskId、taskCode、浏览链接 id），运行内各账号共享，path 不为空时按天保存到磁盘。
+    账号第一次获取任务列表后用 observe() 比较指纹：一致时该账号后续轮次直接使用匹配上的这份列表，省去一次请求和解析；
+    不一致时以新的列表为准更新目录，该账号仍每轮自行获取。
+    """
+
+    def __init__(self, path=TASK_CATALOG_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._entries = self._load()
+
+    def _load(self):
+        if not self.path or not os.path.isfile(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = jsoncodec.load(f)
+        except Exception as e:
+            print(f"读取任务目录失败: {e}")
+            return {}
+        today = datetime.now().strftime("%Y-%m-%d")
+        return {k: v for k, v in entries.items() if v.get('date') == today} if isinstance(entries, dict) else {}
 
-        # 创建RNL实例并设置当前用户ID
-        rnl = RNL(new_cookie)
+    @staticmethod
+    def fingerprint(entries):
+        return zlib.crc32(jsoncodec.dumpb(entries))
+
+    def observe(self, code, tasks):
+        """记录某个账号获取到的任务列表，返回它是否与当天的目录一致"""
+        entries = [catalog_entry(task) for task in tasks]
+        fingerprint = self.fingerprint(entries)
+        today = datetime.now().strftime("%Y-%m-%d")
+        with self._lock:
+            entry = self._entries.get(code)
+            if entry and entry['date'] == today and entry['fingerprint'] == fingerprint:
+                return True
+            self._entries[code] = {'date': today, 'fingerprint': fingerprint, 'tasks': entries}
+            self._dirty = True
+            return False
+
+    def save(self):
+        with self._lock:
+            if not self.path or not self._dirty:
+                return
+            try:
+                with file_lock(self.path):
+                    jsoncodec.write_file(self.path, self._entries)
+                self._dirty = False
+            except Exception as e:
+                print(f"写入任务目录失败: {e}")
+
+
+# ========== 领奖记录 ==========
+CLAIM_LEDGER_FILE = os.environ.get('XIAOMI_CLAIM_LEDGER', 'xiaomi_claims.jsonl')
+CLAIM_PENDING = 'pending'
+CLAIM_REDEEMED = 'redeemed'
+CLAIM_INVALID = 'invalid'
+
+
+class ClaimLedger:
+    """
+    luckDraw 领奖记录：每个 userTaskId 的状态按 待确认 → 已领取 / 已失效 追加写入 path（每行一条紧凑 JSON），
+    同一 userTaskId 以最后一行为准。已领取、已失效（接口返回 10101）的不再请求；待确认的（请求发出后进程退出、
+    请求失败或返回其他错误）由账号下次执行时继续领取。只保留当天的记录，读取时发现过期记录会重写文件；
+    每次追加都在文件锁内重新打开文件，其他进程重写后不会写到已被替换的旧文件。path 为空时只在内存中记录。
+    """
+
+    def __init__(self, path=CLAIM_LEDGER_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = self._load()
+
+    def _load(self):
+        if not self.path or not os.path.isfile(self.path):
+            return {}
+        today = datetime.now().strftime("%Y-%m-%d")
+        entries = {}
+        stale = False
+        try:
+            with file_lock(self.path):
+                with open(self.path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            record = jsoncodec.loads(line)
+                        except ValueError:
+                            # 最后一行可能只写了一半
+                            stale = True
+                            continue
+                        if record.get('date') != today:
+                            stale = True
+                            continue
+                        entries[(record['account'], str(record['userTaskId']))] = record
+                if stale:
+                    self._rewrite(entries.values())
+        except Exception as e:
+            print(f"读取领奖记录失败: {e}")
+            return {}
+        return entries
+
+    def _rewrite(self, records):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(jsoncodec.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def status(self, account, user_task_id):
+        with self._lock:
+            record = self._entries.get((account, str(user_task_id)))
+            return record['status'] if record else None
+
+    def pending(self, account):
+        """账号今天待确认的 userTaskId"""
+        today = datetime.now().strftime("%Y-%m-%d")
+        with self._lock:
+            return [
+                record['userTaskId'] for (key, _), record in self._entries.items()
+                if key == account and record['status'] == CLAIM_PENDING and record['date'] == today
+            ]
+
+    def record(self, account, user_task_id, status):
+        record = {
+            'date': datetime.now().strftime("%Y-%m-%d"),
+            'account': account,
+            'userTaskId': user_task_id,
+            'status': status,
+        }
+        with self._lock:
+            self._entries[(account, str(user_task_id))] = record
+            if not self.path:
+                return
+            try:
+                with file_lock(self.path), open(self.path, "a", encoding="utf-8") as f:
+                    f.write(jsoncodec.dumps(record) + "\n")
+            except Exception as e:
+                print(f"写入领奖记录失败: {e}")
+
+
+# ========== 多账号执行 ==========
+CONFIG_FILE = "xiaomiconfig.json"
+
+
+class ConfigLogWriter:
+    """
+    收集各账号最新的执行日志，按间隔或在运行结束时一次性写回配置文件的 data.log 字段。
+    写回前重新读取磁盘上的最新内容再合并，运行期间机器人新增/修改的账号不会丢失；
+    写入使用临时文件 + 重命名，读取方不会看到写了一半的文件。
+    on_write 不为 None 时每次写回后调用 on_write(写回前的修改时间, 写回后的修改时间)。
+    """
+
+    def __init__(self, config_path=CONFIG_FILE, flush_interval=0, on_write=None):
+        self.config_path = config_path
+        self.flush_interval = flush_interval
+        self.on_write = on_write
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def add(self, us, owner_id, account_notification):
+        with self._lock:
+            self._pending[(us, owner_id)] = account_notification.strip()
+            due = self.flush_interval > 0 and time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        """把积攒的日志合并写回配置文件，失败时保留待写内容留给下一次"""
+        with self._flush_lock:
+            with self._lock:
+                updates, self._pending = self._pending, {}
+                self._last_flush = time.monotonic()
+            if not updates:
+                return True
+            try:
+                with file_lock(self.config_path):
+                    with open(self.config_path, "r", encoding="utf-8") as f:
+                        config = jsoncodec.load(f)
+                    remaining = dict(updates)
+                    for acc in config:
+                        data2 = acc.get("data", {})
+                        key = (data2.get("us"), acc.get("owner_id"))
+                        if key in remaining:
+                            if "data" not in acc or not isinstance(acc["data"], dict):
+                                acc["data"] = {}
+                            acc["data"]["log"] = remaining.pop(key)
+                    before = os.path.getmtime(self.config_path)
+                    jsoncodec.write_file(self.config_path, config, indent=True)
+                    if self.on_write:
+                        self.on_write(before, os.path.getmtime(self.config_path))
+                return True
+            except Exception as e:
+                print(f"写入日志到data.log失败: {e}")
+                with self._lock:
+                    # 写入期间产生的新日志优先
+                    self._pending = {**updates, **self._pending}
+                return False
+
+    def close(self, retries=3):
+        """运行结束时写回剩余日志；配置文件恰好被机器人改写时稍后重试"""
+        for attempt in range(retries):
+            if self.flush():
+                return
+            time.sleep(1)
+
+
+class SharedHTTPAdapter(HTTPAdapter):
+    """多个 Session 共用的连接池：Session.close() 不会关闭它，常驻进程退出时调用 shutdown()"""
+
+    def close(self):
+        pass
+
+    def shutdown(self):
+        super().close()
+
+
+class SyncEngine:
+    """
+    线程引擎：同步发送请求，每个账号使用独立的 requests.Session（Cookie 互不影响）；
+    传入 SharedHTTPAdapter 时各 Session 共用其中的 keep-alive 连接。
+    """
+
+    def __init__(self, adapter=None, timeout=REQUEST_TIMEOUT):
+        self.adapter = adapter
+        self.timeout = timeout
+
+    def get_cookies(self, pass_token, user_id):
+        return get_xiaomi_cookies(pass_token, user_id, self.adapter, self.timeout)
+
+    def new_request(self, cookies):
+        return RnlRequest(cookies, self.adapter, self.timeout)
+
+
+class AsyncEngine:
+    """异步引擎：所有账号共享同一个连接器，Cookie 仍按账号隔离"""
+
+    def __init__(self, connector, timeout=REQUEST_TIMEOUT):
+        self.connector = connector
+        self.timeout = timeout
+
+    def get_cookies(self, pass_token, user_id):
+        return async_get_xiaomi_cookies(pass_token, user_id, self.connector, self.timeout)
+
+    def new_request(self, cookies):
+        return AsyncRnlRequest(cookies, self.connector, self.timeout)
+
+
+class Watchdog:
+    """
+    兜底的看门狗线程：账号超过时间预算 grace 秒后仍未结束（例如卡在一次迟迟不返回的请求上），
+    直接按超时记录它的结果，不再等待；该账号之后返回的结果会被丢弃。
+    """
+
+    def __init__(self, ctx, budget, grace, interval=1.0):
+        self.ctx = ctx
+        self.budget = budget
+        self.grace = grace
+        self._lock = threading.Lock()
+        self._active = {}
+        self._expired = set()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(interval,), name='xiaomi-watchdog', daemon=True)
+        self._thread.start()
+
+    def watch(self, index, account):
+        with self._lock:
+            self._active[index] = (time.monotonic() + self.budget + self.grace, account)
+
+    def finish(self, index):
+        """账号正常结束时调用，返回 False 表示看门狗已按超时记录过它"""
+        with self._lock:
+            self._active.pop(index, None)
+            return index not in self._expired
+
+    def expired(self, index):
+        with self._lock:
+            return index in self._expired
+
+    def expire(self, index):
+        """按超时记录账号结果（只记录一次）"""
+        with self._lock:
+            entry = self._active.pop(index, None)
+            if entry is None:
+                return
+            self._expired.add(index)
+        account = entry[1]
+        data = account.get('data', {})
+        error = f"执行超时：超过 {self.budget:g} 秒仍未结束，已放弃等待"
+        print(f"账号 {data.get('us')} {error}")
+        result = AccountResult(
+            index, data.get('userId'), data.get('us'), account.get('owner_id'),
+            error=error, elapsed=self.budget + self.grace,
+        )
+        self.ctx.log_writer.add(result.us, result.owner_id, result.render())
+        self.ctx.report.emit(result)
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            now = time.monotonic()
+            with self._lock:
+                expired = [index for index, (deadline, _) in self._active.items() if now >= deadline]
+            for index in expired:
+                self.expire(index)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+class RunContext:
+    """
+    一次运行内所有账号共享的状态。
+    request_timeout 为单次请求超时；account_budget 大于 0 时每个账号最多执行这么多秒，
+    超时的账号按超时记录，另有看门狗兜底。
+    done_cache 为 DoneCache 时跳过当天已完成的账号（force 为 True 时仍然执行，但照常记录）。
+    activities 为每个账号登录后依次执行的活动插件，第一个为主活动。
+    owner_policy 为 OwnerPolicy 时按 owner_id 公平调度账号，为 None 时按配置顺序执行。
+    checkpoint 为 CheckpointJournal 时跳过中断前已完成的账号（需同时加入 report 的输出端）。
+    task_catalog 为各账号共享的当天任务目录，默认只在本次运行内共享。
+    claim_ledger 为 ClaimLedger 时跳过已领取的 userTaskId，并继续领取上次未确认的奖励。
+    """
+
+    def __init__(self, config_path=CONFIG_FILE, cookie_cache=None, log_flush_interval=0, report=None,
+                 history=None, request_timeout=REQUEST_TIMEOUT, account_budget=0, done_cache=None, force=False,
+                 activities=None, owner_policy=None, checkpoint=None, task_catalog=None,
+                 claim_ledger=None, on_config_write=None):
+        self.config_path = config_path
+        self.claim_ledger = claim_ledger
+        self.task_catalog = task_catalog if task_catalog is not None else TaskCatalog(path=None)
+        self.checkpoint = checkpoint
+        self.owner_policy = owner_policy
+        self.activities = activities or [VIDEO_ACTIVITY]
+        self.cookie_cache = cookie_cache
+        self.history = history
+        self.done_cache = done_cache
+        self.force = force
+        self.log_writer = ConfigLogWriter(config_path, flush_interval=log_flush_interval, on_write=on_config_write)
+        self.report = report if report is not None else RunReport([StdoutSink()])
+        self.request_timeout = request_timeout
+        self.account_budget = account_budget
+        self.watchdog = None
+        if account_budget > 0:
+            self.watchdog = Watchdog(self, account_budget, grace=(request_timeout or 0) + 5)
+
+    def queue(self, accounts, start=0):
+        """本次运行的待执行队列，元素为 (序号, 账号)，序号仍按配置顺序"""
+        return FairQueue(enumerate(accounts, start), self.owner_policy)
+
+    def close(self):
+        """运行结束时关闭输出端，把日志和缓存落盘；各项互不影响，一项失败时其余照常保存"""
+        steps = [self.report.close, self.log_writer.close]
+        if self.watchdog:
+            steps.insert(0, self.watchdog.stop)
+        for store in (self.cookie_cache, self.history, self.done_cache, self.task_catalog):
+            if store:
+                steps.append(store.save)
+        for step in steps:
+            try:
+                step()
+            except Exception as e:
+                print(f"运行结束时保存失败: {e}")
+
+
+def login_steps(engine, pass_token, user_id, cookie_cache=None):
+    """登录获取Cookie（步骤生成器），返回 (cookie, 错误信息)，成功时写入缓存"""
+    with METRICS.phase('cookie'):
+        cookie_result = yield Call(engine.get_cookies, pass_token, user_id)
+
+    # 处理返回结果 - 兼容原函数返回值
+    if isinstance(cookie_result, tuple):
+        return cookie_result
+    if cookie_cache:
+        cookie_cache.put(user_id, cookie_result)
+    return cookie_result, None
+
+
+def account_steps(account, engine, ctx, index=0):
+    """
+    单个账号的完整处理流程（步骤生成器）。
+    完成后把 AccountResult 交给 ctx.report 并返回，index 为账号在配置文件中的位置。
+    """
+    with METRICS.phase('account'):
+        return (yield from _account_steps(account, engine, ctx, index))
+
+
+def _account_steps(account, engine, ctx, index):
+    start = time.perf_counter()
+    data = account.get('data', {})
+    us = data.get('us')
+    owner_id = account.get('owner_id')
+    user_id = data.get('userId')
+    if account.get('read_error'):
+        # 配置文件读取出错后没能执行的账号
+        return _emit_result(ctx, AccountResult(index, user_id, us, owner_id, error=account['read_error']))
+    codes = [activity.code for activity in ctx.activities]
+
+    restored = ctx.checkpoint.restored(account, index) if ctx.checkpoint else None
+    if restored:
+        print(f"\n账号 {us} 已在中断前完成（检查点），跳过")
+        return _emit_result(ctx, restored)
+
+    entry = ctx.done_cache.get(user_id, codes) if ctx.done_cache and not ctx.force else None
+    if entry:
+        print(f"\n账号 {us} 今日奖励已领完（本地完成记录），跳过")
+        return _emit_result(ctx, ctx.done_cache.result(index, account, entry))
+    print(f"\n>>>>>>>>>> 正在处理账号 {us}id{user_id} <<<<<<<<<<")
+
+    state = {}
+    steps = _run_account(account, engine, ctx, state)
+    if ctx.account_budget > 0:
+        state['deadline'] = time.monotonic() + ctx.account_budget
+        steps = with_deadline(steps, state['deadline'])
+        ctx.watchdog.watch(index, account)
+    timeout_error = None
+    try:
+        success = yield from steps
+    except AccountTimeout:
+        success = False
+        timeout_error = f"执行超时：超过 {ctx.account_budget:g} 秒未完成，已放弃"
+        print(f"账号 {us} {timeout_error}")
+
+    # 生成当前账号的执行结果
+    rnls = state.get('rnls')
+    if rnls:
+        rnl = rnls[0]
+        yield Call(rnl.rr.close)
+        if timeout_error:
+            rnl.error_info = timeout_error
+        extra = rnls[1:] if state.get('ran') else []
+        result = AccountResult.from_rnl(index, account, rnl, success, time.perf_counter() - start, extra)
+        if ctx.done_cache and not timeout_error and all(r.done for r in rnls):
+            ctx.done_cache.mark(result, codes)
+    else:
+        result = AccountResult(index, user_id, us, owner_id, error=timeout_error,
+                               elapsed=time.perf_counter() - start)
+    return _emit_result(ctx, result)
+
+
+def _activity_steps(rnl):
+    """单个活动的执行流程，异常只记录到该活动，不影响同一账号的其他活动"""
+    try:
+        return (yield from rnl.steps())
+    except AccountTimeout:
+        raise
+    except Exception as e:
+        rnl.error_info = f"执行异常: {str(e)}"
+        print(rnl.error_info)
+        return False
+
+
+def _run_account(account, engine, ctx, state):
+    """
+    登录一次后执行所有活动（步骤生成器），各活动的等待互相重叠。
+    创建的 RNL 实例（与 ctx.activities 一一对应，共用一个请求会话）放入 state，返回 Cookie 是否获取成功。
+    """
+    data = account.get('data', {})
+    us = data.get('us')
+    user_id = data.get('userId')
+    pass_token = data.get('passToken')
+
+    # 优先使用缓存的Cookie，省去整条 serviceLogin 跳转链
+    cookie_cache = ctx.cookie_cache
+    new_cookie = cookie_cache.get(user_id) if cookie_cache else None
+    from_cache = new_cookie is not None
+    error = None
+    if from_cache:
+        print(f"账号 {us} 使用缓存的Cookie")
+    else:
+        new_cookie, error = yield from login_steps(engine, pass_token, user_id, cookie_cache)
+
+    # 创建各活动的RNL实例并设置当前用户ID
+    rr = engine.new_request(new_cookie)
+    rr.deadline = state.get('deadline')
+    rnls = [
+        RNL(new_cookie, rr=rr, history=ctx.history, activity=activity, catalog=ctx.task_catalog,
+            ledger=ctx.claim_ledger)
+        for activity in ctx.activities
+    ]
+    for rnl in rnls:
         rnl.current_user_id = user_id
+    state['rnls'] = rnls
+
+    if error:
+        rnls[0].error_info = error
+        return False
 
+    if not from_cache:
+        print(f"账号 {us} Cookie获取成功")
+
+    # 执行主程序
+    state['ran'] = True
+    results = yield from overlap_steps(_activity_steps(rnl) for rnl in rnls)
+    failed = [rnl for rnl, ok in zip(rnls, results) if not ok and rnl.auth_failed]
+    if failed and from_cache:
+        # 缓存的Cookie已失效，重新登录后再执行一次
+        print(f"账号 {us} 缓存的Cookie已失效，重新登录")
+        cookie_cache.invalidate(user_id)
+        new_cookie, error = yield from login_steps(engine, pass_token, user_id, cookie_cache)
         if error:
-            rnl.error_info = error
+            for rnl in failed:
+                rnl.error_info = error
         else:
             print(f"账号 {us} Cookie获取成功")
-            cookie_list.append(new_cookie)
+            rr.update_cookies(new_cookie)
+            for rnl in failed:
+                rnl.error_info = ""
+                rnl.auth_failed = False
+            yield from overlap_steps(_activity_steps(rnl) for rnl in failed)
+    return not error
+
+
+def _emit_result(ctx, result):
+    """写回日志并输出账号结果；看门狗已按超时记录过的账号不再重复输出"""
+    if ctx.watchdog and not ctx.watchdog.finish(result.index):
+        return result
+    # ========== 写入最新日志到data.log（批量写回） ==========
+    ctx.log_writer.add(result.us, result.owner_id, result.render())
+    ctx.report.emit(result)
+    return result
+
+
+def process_account(account, ctx, index=0, engine=None):
+    """同步处理单个账号，返回 AccountResult"""
+    return run_steps(account_steps(account, engine or SyncEngine(timeout=ctx.request_timeout), ctx, index))
+
+
+def _failed_result(ctx, index, account, e):
+    """账号处理过程中出现未捕获异常时的兜底结果"""
+    data = account.get('data', {})
+    error = f"执行异常: {str(e)}"
+    print(error)
+    result = AccountResult(index, data.get('userId'), data.get('us'), account.get('owner_id'), error=error)
+    return _emit_result(ctx, result)
+
 
-            # 执行主程序
+def _spawn(fn, *args):
+    """在守护线程中执行 fn，返回对应的 Future；被放弃的线程不会阻止进程退出"""
+    future = Future()
+
+    def target():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=target, daemon=True).start()
+    return future
+
+
+def run_accounts(accounts, workers=1, ctx=None, start=0, engine=None):
+    """
+    使用最多 workers 个线程同时处理多个账号，每个账号独立创建 RnlRequest 会话。
+    结果在账号完成时即交给 ctx.report（按原始顺序输出），返回该 RunReport；
+    start 为第一个账号的序号，分批执行时保证序号连续。
+    看门狗按超时记录的账号立即让出名额，卡住的线程留在后台（守护线程）直到请求返回。
+    """
+    ctx = ctx or RunContext()
+    queue = ctx.queue(accounts, start)
+    workers = max(1, workers)
+    poll = 1.0 if ctx.watchdog else None
+    running = {}
+    while True:
+        # 有空闲名额时按调度顺序补充账号
+        while len(running) < workers:
+            item = queue.next()
+            if item is None:
+                break
+            running[_spawn(process_account, item[1], ctx, item[0], engine)] = item
+        if not running:
+            break
+        done, _ = wait(running, timeout=poll, return_when=FIRST_COMPLETED)
+        for future in done:
+            item = running.pop(future)
+            queue.done(item)
             try:
-                rnl.main()
+                future.result()
             except Exception as e:
-                rnl.error_info = f"执行异常: {str(e)}"
-                print(rnl.error_info)
+                _failed_result(ctx, *item, e)
+        if ctx.watchdog:
+            for future, item in list(running.items()):
+                if ctx.watchdog.expired(item[0]):
+                    del running[future]
+                    queue.done(item)
+    return ctx.report
+
 
-        # 生成当前账号的通知消息并添加到完整通知中
-        account_notification = generate_notification(user_id, rnl,us)
-        full_notification += account_notification
+async def run_accounts_async(accounts, concurrency=100, pool_size=20, ctx=None, start=0, connector=None):
+    """
+    在单个事件循环中同时处理多个账号。
+    所有账号共享一个连接池（最多 pool_size 个连接），等待期间不占用线程；返回 ctx.report。
+    传入 connector 时复用它且结束后不关闭，由调用方管理。
+    """
+    ctx = ctx or RunContext()
+    owns_connector = connector is None
+    if owns_connector:
+        connector = create_async_connector(limit=pool_size)
+    engine = AsyncEngine(connector, ctx.request_timeout)
+    queue = ctx.queue(accounts, start)
+    concurrency = max(1, concurrency)
 
-        # ========== 写入最新日志到data.log ==========
+    async def run_one(index, account):
         try:
-            with open("xiaomiconfig.json", "r", encoding="utf-8") as f:
-                config = json.load(f)
-            for acc in config:
-                data2 = acc.get("data", {})
-                if data2.get("us") == us and acc.get("owner_id") == owner_id:
-                    if "data" not in acc or not isinstance(acc["data"], dict):
-                        acc["data"] = {}
-                    acc["data"]["log"] = account_notification.strip()
-                    break
-            with open("xiaomiconfig.json", "w", encoding="utf-8") as f:
-                json.dump(config, f, indent=4, ensure_ascii=False)
+            coro = run_steps_async(account_steps(account, engine, ctx, index))
+            if ctx.watchdog:
+                # 超过预算和宽限时间后直接取消，由看门狗按超时记录
+                await asyncio.wait_for(coro, ctx.account_budget + ctx.watchdog.grace)
+            else:
+                await coro
+        except asyncio.TimeoutError:
+            ctx.watchdog.expire(index)
         except Exception as e:
-            print(f"写入日志到data.log失败: {e}")
+            _failed_result(ctx, index, account, e)
 
-    # 添加汇总信息
-    full_notification += f"""
-📊 执行汇总：
-✅ 成功账号数：{len(cookie_list)}
-⚠️ 失败账号数：{len(ORIGINAL_COOKIES) - len(cookie_list)}
-"""
+    running = {}
+    try:
+        while True:
+            while len(running) < concurrency:
+                item = queue.next()
+                if item is None:
+                    break
+                running[asyncio.ensure_future(run_one(*item))] = item
+            if not running:
+                break
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                queue.done(running.pop(task))
+    finally:
+        for task in running:
+            task.cancel()
+        if owns_connector:
+            await connector.close()
+    return ctx.report
+
+
+def run_accounts_wheel(accounts, workers=8, max_active=500, ctx=None, start=0, engine=None):
+    """
+    使用时间轮调度器处理账号：最多 max_active 个账号同时处于执行中，
+    只占用 workers 个工作线程；返回 ctx.report。
+    """
+    ctx = ctx or RunContext()
+    engine = engine or SyncEngine(timeout=ctx.request_timeout)
+    scheduler = WheelScheduler(workers=workers, max_active=max_active)
+    jobs = (
+        ((index, account), lambda index=index, account=account: account_steps(account, engine, ctx, index))
+        for index, account in enumerate(accounts, start)
+    )
+    # 队列元素为 ((序号, 账号), 工厂)
+    queue = FairQueue(jobs, ctx.owner_policy, owner_of=lambda job: job[0][1].get('owner_id'))
+    scheduler.run(jobs, on_error=lambda key, e: _failed_result(ctx, *key, e), queue=queue)
+    return ctx.report
+
+
+# ========== 分片与任务队列 ==========
+def account_key(account):
+    """账号的稳定标识，不随配置文件中的顺序变化；也可传入该账号的 AccountResult"""
+    if isinstance(account, AccountResult):
+        owner_id, us, user_id = account.owner_id, account.us, account.user_id
+    else:
+        data = account.get('data', {})
+        owner_id, us, user_id = account.get('owner_id'), data.get('us'), data.get('userId')
+    return f"{owner_id}:{us}:{user_id}"
+
+
+def parse_shard(value):
+    """解析 k/n 形式的分片参数（1 <= k <= n）"""
+    try:
+        k, n = (int(x) for x in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"分片格式应为 k/n，如 1/4: {value}")
+    if not 1 <= k <= n:
+        raise argparse.ArgumentTypeError(f"分片序号应在 1 到 {n} 之间: {value}")
+    return k, n
+
+
+def select_accounts(accounts, shard=None, owners=None, us=None):
+    """
+    按 owner_id / 账号名筛选，再按 userId 的哈希取第 k/n 个分片。
+    分片只依赖账号本身，各进程读到的配置顺序不同也不会重复或遗漏。
+    """
+    return list(iter_selected(accounts, shard, owners, us))
+
+
+def iter_selected(accounts, shard=None, owners=None, us=None, counts=None):
+    """select_accounts 的逐个版本，counts 为 Counter 时累计读到的账号数（total）和选中的账号数（selected）"""
+    for account in accounts:
+        if counts is not None:
+            counts['total'] += 1
+        data = account.get('data', {})
+        if owners and str(account.get('owner_id')) not in owners:
+            continue
+        if us and data.get('us') not in us:
+            continue
+        if shard:
+            k, n = shard
+            key = str(data.get('userId') or data.get('us'))
+            if zlib.crc32(key.encode('utf-8')) % n != k - 1:
+                continue
+        if counts is not None:
+            counts['selected'] += 1
+        yield account
+
+
+class WorkQueue:
+    """
+    基于本地 SQLite 文件的账号任务队列，多个进程（或共享目录的多台机器）从中租用账号。
+    每天一轮：第一次出现的账号加入队列，租约超过 lease 秒未完成的账号会被其他进程重新领取，
+    同一账号最多尝试 max_attempts 次。
+    """
+
+    def __init__(self, path, lease=600, max_attempts=3, worker_id=None):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.run_date = datetime.now().strftime("%Y-%m-%d")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS work_queue ("
+            " run_date TEXT NOT NULL, account_key TEXT NOT NULL, position INTEGER NOT NULL,"
+            " status TEXT NOT NULL DEFAULT 'pending', worker TEXT, lease_until REAL NOT NULL DEFAULT 0,"
+            " attempts INTEGER NOT NULL DEFAULT 0, success INTEGER,"
+            " PRIMARY KEY (run_date, account_key))"
+        )
+
+    def seed(self, accounts):
+        """把本进程看到的账号加入今天的队列，已存在的账号保持原状态"""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO work_queue (run_date, account_key, position) VALUES (?, ?, ?)",
+                [(self.run_date, account_key(account), i) for i, account in enumerate(accounts)],
+            )
+
+    def lease_batch(self, size):
+        """领取最多 size 个待处理或租约已过期的账号，返回其 account_key 列表"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT account_key FROM work_queue WHERE run_date = ? AND attempts < ?"
+                    " AND (status = 'pending' OR (status = 'leased' AND lease_until < ?))"
+                    " ORDER BY position LIMIT ?",
+                    (self.run_date, self.max_attempts, now, size),
+                ).fetchall()
+                keys = [row[0] for row in rows]
+                self._conn.executemany(
+                    "UPDATE work_queue SET status = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1"
+                    " WHERE run_date = ? AND account_key = ?",
+                    [(self.worker_id, now + self.lease, self.run_date, key) for key in keys],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return keys
+
+    def complete(self, key, success):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE work_queue SET status = 'done', success = ?, lease_until = 0"
+                " WHERE run_date = ? AND account_key = ? AND worker = ?",
+                (int(bool(success)), self.run_date, key, self.worker_id),
+            )
+
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM work_queue WHERE run_date = ? GROUP BY status",
+                (self.run_date,),
+            ).fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class QueueSink:
+    """账号完成时在队列中标记为已完成"""
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    def emit(self, result):
+        self.queue.complete(account_key(result), result.success)
+
+    def close(self):
+        pass
+
+
+def run_queue(queue, accounts, run_batch, batch_size):
+    """循环领取一批账号交给 run_batch(批次账号, 起始序号) 执行，直到队列中没有可领取的账号"""
+    by_key = {account_key(account): account for account in accounts}
+    start = 0
+    while True:
+        keys = queue.lease_batch(batch_size)
+        if not keys:
+            return
+        # 其他进程加入、本进程配置中没有的账号等租约过期后由其他进程处理
+        batch = [by_key[key] for key in keys if key in by_key]
+        if batch:
+            run_batch(batch, start)
+            start += len(batch)
+
+
+def build_parser(description="小米钱包视频会员任务"):
+    """命令行参数，未指定时读取青龙面板环境变量"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        '-w', '--workers', type=int,
+        default=int(os.environ.get('XIAOMI_WORKERS', '1')),
+        help="同时处理的账号数（环境变量 XIAOMI_WORKERS，默认 1 即逐个执行）",
+    )
+    parser.add_argument(
+        '--engine', choices=('thread', 'async', 'wheel'),
+        default=os.environ.get('XIAOMI_ENGINE', 'thread'),
+        help="执行引擎：thread 线程池 / async 单事件循环共享连接池 / wheel 时间轮调度（环境变量 XIAOMI_ENGINE）",
+    )
+    parser.add_argument(
+        '--max-active', type=int,
+        default=int(os.environ.get('XIAOMI_MAX_ACTIVE', '500')),
+        help="wheel 引擎同时处于执行中的账号上限（环境变量 XIAOMI_MAX_ACTIVE，默认 500）",
+    )
+    parser.add_argument(
+        '--pool-size', type=int,
+        default=int(os.environ.get('XIAOMI_POOL_SIZE', '20')),
+        help="async 引擎共享连接池的最大连接数（环境变量 XIAOMI_POOL_SIZE，默认 20）",
+    )
+    parser.add_argument(
+        '--cookie-ttl', type=float,
+        default=float(os.environ.get('XIAOMI_COOKIE_TTL_HOURS', '72')),
+        help="登录Cookie缓存的有效小时数，0 表示不使用缓存（环境变量 XIAOMI_COOKIE_TTL_HOURS，默认 72）",
+    )
+    parser.add_argument(
+        '--log-flush-interval', type=float,
+        default=float(os.environ.get('XIAOMI_LOG_FLUSH_INTERVAL', '60')),
+        help="执行日志写回配置文件的间隔秒数，0 表示只在运行结束时写回（环境变量 XIAOMI_LOG_FLUSH_INTERVAL，默认 60）",
+    )
+    parser.add_argument(
+        '--schedule', choices=('fair', 'fifo'),
+        default=os.environ.get('XIAOMI_SCHEDULE', 'fifo'),
+        help="账号调度方式：fifo 按配置文件顺序 / fair 在各 owner_id 之间轮流（环境变量 XIAOMI_SCHEDULE，默认 fifo）",
+    )
+    parser.add_argument(
+        '--owner-weights',
+        default=os.environ.get('XIAOMI_OWNER_WEIGHTS', ''),
+        help="fair 调度下各用户的权重，如 123=2,456=0.5，未设置的用户为 1（环境变量 XIAOMI_OWNER_WEIGHTS）",
+    )
+    parser.add_argument(
+        '--owner-cap',
+        default=os.environ.get('XIAOMI_OWNER_CAP', '0'),
+        help="fair 调度下每个用户同时执行的账号数上限，如 4 或 4,123=8（单独的数字为默认上限），0 表示不限制（环境变量 XIAOMI_OWNER_CAP）",
+    )
+    parser.add_argument(
+        '--request-timeout', type=float,
+        default=REQUEST_TIMEOUT,
+        help="单次请求的超时秒数（环境变量 XIAOMI_REQUEST_TIMEOUT，默认 15）",
+    )
+    parser.add_argument(
+        '--account-budget', type=float,
+        default=float(os.environ.get('XIAOMI_ACCOUNT_BUDGET', '300')),
+        help="单个账号最多执行的秒数，超时按失败记录并处理下一个账号，0 表示不限制（环境变量 XIAOMI_ACCOUNT_BUDGET，默认 300）",
+    )
+    parser.add_argument(
+        '--activities',
+        default=os.environ.get('XIAOMI_ACTIVITIES', VIDEO_ACTIVITY.code),
+        help="逗号分隔的活动列表，每个账号登录一次后依次执行，各活动的浏览等待互相重叠；"
+             "每项为活动代码或 活动代码=任务名关键词，第一个为主活动（环境变量 XIAOMI_ACTIVITIES，默认 2211-videoWelfare）",
+    )
+    parser.add_argument(
+        '--force', action='store_true',
+        help="忽略当日完成记录，重新执行今天已领完奖励的账号",
+    )
+    parser.add_argument(
+        '--checkpoint',
+        default=os.environ.get('XIAOMI_CHECKPOINT', 'xiaomi_checkpoint.jsonl'),
+        help="检查点日志路径，记录本次运行已完成的账号，运行正常结束后删除，留空则不记录（环境变量 XIAOMI_CHECKPOINT）",
+    )
+    parser.add_argument(
+        '--checkpoint-interval', type=float,
+        default=float(os.environ.get('XIAOMI_CHECKPOINT_INTERVAL', '5')),
+        help="检查点日志 fsync 的最小间隔秒数，0 表示每个账号都 fsync（环境变量 XIAOMI_CHECKPOINT_INTERVAL，默认 5）",
+    )
+    parser.add_argument(
+        '--resume', action='store_true',
+        help="从上次中断的运行继续：跳过检查点中今天已成功的账号，它们的结果合并进本次的输出和通知",
+    )
+    parser.add_argument(
+        '--report',
+        default=os.environ.get('XIAOMI_REPORT', 'stdout'),
+        help=f"逗号分隔的结果输出方式：stdout 按顺序实时打印 / jsonl 逐行写入 {REPORT_JSONL_FILE} / "
+             f"owner 按用户分组写入 {REPORT_OWNER_FILE} / digest 运行结束后通过 Telegram 机器人给每个用户推送一条汇总"
+             f"（环境变量 XIAOMI_REPORT，默认 stdout）",
+    )
+    parser.add_argument(
+        '--shard', type=parse_shard,
+        default=parse_shard(os.environ['XIAOMI_SHARD']) if os.environ.get('XIAOMI_SHARD') else None,
+        help="只处理第 k 个分片（共 n 个，按 userId 哈希划分），格式 k/n（环境变量 XIAOMI_SHARD）",
+    )
+    parser.add_argument(
+        '--owner',
+        default=os.environ.get('XIAOMI_OWNER', ''),
+        help="逗号分隔的 owner_id，只处理这些用户的账号（环境变量 XIAOMI_OWNER）",
+    )
+    parser.add_argument(
+        '--us',
+        default=os.environ.get('XIAOMI_US', ''),
+        help="逗号分隔的账号名，只处理这些账号（环境变量 XIAOMI_US）",
+    )
+    parser.add_argument(
+        '--queue',
+        default=os.environ.get('XIAOMI_QUEUE', ''),
+        help="SQLite 任务队列文件，指定后多个进程从队列中领取账号（环境变量 XIAOMI_QUEUE，默认不使用）",
+    )
+    parser.add_argument(
+        '--lease', type=float,
+        default=float(os.environ.get('XIAOMI_LEASE_SECONDS', '600')),
+        help="队列模式下账号租约秒数，进程崩溃后超过该时间的账号会被重新领取（环境变量 XIAOMI_LEASE_SECONDS，默认 600）",
+    )
+    parser.add_argument(
+        '--worker-id',
+        default=os.environ.get('XIAOMI_WORKER_ID') or f"{socket.gethostname()}-{os.getpid()}",
+        help="队列模式下本进程的标识，同时作为报告、运行指标和检查点文件名的后缀（环境变量 XIAOMI_WORKER_ID，默认 主机名-进程号）",
+    )
+    parser.add_argument(
+        '--metrics-dir',
+        default=os.environ.get('XIAOMI_METRICS_DIR', '.'),
+        help="运行指标 xiaomi_metrics.json / xiaomi_metrics.prom 的输出目录，留空则不输出（环境变量 XIAOMI_METRICS_DIR，默认当前目录）",
+    )
+    return parser
+
+
+def parse_args(argv=None):
+    return build_parser().parse_args(argv)
+
+
+def iter_accounts(config_path=CONFIG_FILE, drop=('log',)):
+    """
+    逐个读取账号配置，边解析边返回，不会把整个配置文件读入内存；
+    drop 中的字段（默认为执行时用不到、每个账号可达数 KB 的 data.log）读到后即丢弃。格式错误时抛出异常。
+    """
+    with open(config_path, "r", encoding="utf-8") as f:
+        for account in jsoncodec.iter_array(f):
+            assert isinstance(account, dict), "配置文件格式错误，应为账号字典列表"
+            data = account.get('data')
+            if isinstance(data, dict):
+                for key in drop:
+                    data.pop(key, None)
+            yield account
+
+
+def load_accounts(config_path=CONFIG_FILE, drop=('log',)):
+    """
+    一次读入全部账号配置（drop 中的字段同样丢弃），格式错误时抛出异常。
+    需要全部账号时使用，整体解析比 iter_accounts 逐个解析快得多。
+    """
+    with open(config_path, "rb") as f:
+        accounts = jsoncodec.load(f)
+    assert isinstance(accounts, list), "配置文件格式错误，应为账号字典列表"
+    for account in accounts:
+        assert isinstance(account, dict), "配置文件格式错误，应为账号字典列表"
+        data = account.get('data')
+        if isinstance(data, dict):
+            for key in drop:
+                data.pop(key, None)
+    return accounts
+
+
+def streams_accounts(args):
+    """按配置顺序执行且不使用任务队列时不需要预先读入全部账号，边读取边执行"""
+    return args.schedule == 'fifo' and not args.queue
+
+
+def _read_guarded(accounts, reread):
+    """
+    边读边执行时配置文件读到一半出错：已开始的账号照常完成，之后的账号不再执行，
+    而是带上 read_error 交给执行器，记为失败。reread() 重新读取并筛选全部账号，用来确定未执行的账号；
+    仍然读取失败时用一个空账号代表剩余部分。
+    """
+    seen = set()
+    try:
+        for account in accounts:
+            seen.add(account_key(account))
+            yield account
+    except Exception as e:
+        error = f"读取{CONFIG_FILE}失败，未执行: {e}"
+        print(error)
+        try:
+            rest = [account for account in reread() if account_key(account) not in seen]
+        except Exception:
+            rest = [{}]
+        for account in rest:
+            yield {**account, 'read_error': error}
+
+
+def run_once(args, accounts, cookie_cache=None, history=None, engine=None, connector=None, loop=None,
+             done_cache=None, task_catalog=None, claim_ledger=None, on_config_write=None):
+    """
+    按命令行参数执行一轮：筛选账号、执行、写回日志和缓存，返回 RunReport，没有符合条件的账号时返回 None。
+    accounts 可以是 iter_accounts 的迭代器：按配置顺序执行且不使用任务队列时边读取边筛选边执行，
+    否则先读入全部账号。常驻进程传入跨轮复用的缓存、SyncEngine（共享连接池）以及 async 引擎的连接器和事件循环，
+    并通过 on_config_write 得知本轮写回 data.log 后配置文件的修改时间。
+    """
+    counts = Counter()
+    filters = dict(
+        shard=args.shard,
+        owners={x.strip() for x in args.owner.split(',') if x.strip()},
+        us={x.strip() for x in args.us.split(',') if x.strip()},
+    )
+    selected = iter_selected(accounts, counts=counts, **filters)
+    if streams_accounts(args):
+        selected = _read_guarded(selected, lambda: select_accounts(load_accounts(), **filters))
+        first = next(selected, None)
+        if first is None:
+            return None
+        selected = itertools.chain([first], selected)
+    else:
+        selected = list(selected)
+        if counts['selected'] < counts['total']:
+            print(f"按分片/筛选条件处理 {counts['selected']}/{counts['total']} 个账号")
+        if not selected:
+            return None
+
+    suffix = run_suffix(args)
+    report = build_report([k.strip() for k in args.report.split(',') if k.strip()], suffix)
+    report.sinks.append(OwnerStatsSink())
+    checkpoint = None
+    if args.checkpoint:
+        # 各分片、队列进程使用各自的检查点
+        checkpoint = CheckpointJournal(suffixed(args.checkpoint, suffix), args.checkpoint_interval, resume=args.resume)
+        report.sinks.append(checkpoint)
+    queue = None
+    if args.queue:
+        queue = WorkQueue(args.queue, lease=args.lease, worker_id=args.worker_id)
+        queue.seed(selected)
+        report.sinks.append(QueueSink(queue))
+    ctx = RunContext(
+        log_flush_interval=args.log_flush_interval,
+        cookie_cache=cookie_cache,
+        report=report,
+        history=history,
+        request_timeout=args.request_timeout,
+        account_budget=args.account_budget,
+        done_cache=done_cache,
+        force=args.force,
+        activities=parse_activities(args.activities),
+        owner_policy=OwnerPolicy.from_spec(args.owner_weights, args.owner_cap) if args.schedule == 'fair' else None,
+        checkpoint=checkpoint,
+        task_catalog=task_catalog,
+        claim_ledger=claim_ledger,
+        on_config_write=on_config_write,
+    )
+
+    def run_batch(batch, start=0):
+        if args.engine == 'async':
+            coro = run_accounts_async(
+                batch, concurrency=args.workers, pool_size=args.pool_size, ctx=ctx, start=start,
+                connector=connector,
+            )
+            if loop:
+                asyncio.run_coroutine_threadsafe(coro, loop).result()
+            else:
+                asyncio.run(coro)
+        elif args.engine == 'wheel':
+            run_accounts_wheel(
+                batch, workers=args.workers, max_active=args.max_active, ctx=ctx, start=start,
+                engine=engine,
+            )
+        else:
+            run_accounts(batch, workers=args.workers, ctx=ctx, start=start, engine=engine)
+
+    try:
+        if queue:
+            batch_size = args.max_active if args.engine == 'wheel' else args.workers
+            run_queue(queue, selected, run_batch, max(1, batch_size))
+        else:
+            run_batch(selected)
+        if checkpoint:
+            checkpoint.completed = True
+    finally:
+        ctx.close()
+        if streams_accounts(args) and counts['selected'] < counts['total']:
+            print(f"按分片/筛选条件处理 {counts['selected']}/{counts['total']} 个账号")
+        if queue:
+            print(f"任务队列状态: {queue.stats()}")
+            queue.close()
+        if args.metrics_dir:
+            METRICS.dump(args.metrics_dir, suffix)
+    return ctx.report
+
+
+def run_summary(report):
+    """执行汇总，附带熔断和限流情况"""
+    summary_notification = report.summary_text()
+    for summary in (CIRCUIT_BREAKER.summary(), RATE_LIMITER.summary()):
+        if summary:
+            summary_notification += summary + "\n"
+    return summary_notification
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    # 多账号配置区 ##################################
+    try:
+        if streams_accounts(args):
+            # 逐个读取账号，先读出第一个以便及早发现文件不存在、格式错误或没有账号
+            ORIGINAL_COOKIES = iter_accounts()
+            first = next(ORIGINAL_COOKIES, None)
+            if first is not None:
+                ORIGINAL_COOKIES = itertools.chain([first], ORIGINAL_COOKIES)
+        else:
+            ORIGINAL_COOKIES = load_accounts()
+            first = ORIGINAL_COOKIES[0] if ORIGINAL_COOKIES else None
+    except Exception as e:
+        print(f"读取xiaomiconfig.json失败: {e}")
+        exit(1)
+    # 结束配置 ######################################
+
+    if first is None:
+        print("没有账号")
+        exit(1)
+    if args.engine == 'async' and aiohttp is None:
+        print("async 引擎需要安装 aiohttp，请先运行 requirements.py")
+        exit(1)
+    if args.engine == 'async' and os.environ.get('XIAOMI_CASSETTE'):
+        # 录制/回放只挂在 requests 会话上，async 引擎会绕过它直接访问网络
+        print("录制/回放（XIAOMI_CASSETTE）只支持 thread 和 wheel 引擎，请去掉 --engine async")
+        exit(1)
+
+    report = run_once(
+        args,
+        ORIGINAL_COOKIES,
+        cookie_cache=CookieCache(ttl=args.cookie_ttl * 3600) if args.cookie_ttl > 0 else None,
+        history=HistoryStore() if HISTORY_FILE else None,
+        done_cache=DoneCache() if DONE_FILE else None,
+        task_catalog=TaskCatalog(),
+        claim_ledger=ClaimLedger(),
+    )
+    if report is None:
+        exit(0)
+
+    # 添加汇总信息（各账号的结果已由输出端实时打印）
+    summary_notification = run_summary(report)
 
-    # 打印最终通知消息
-    print(full_notification)
+    # 打印汇总消息
+    print(summary_notification)
 
     # 此处可添加实际的消息推送代码
-    # send("小米钱包任务推送", full_notification)
+    # send("小米钱包任务推送", summary_notification)
@@ -0,0 +1,359 @@
+# 常驻运行 xiaomi.py：连接池、Cookie 缓存和任务记录跨轮保留在内存中，按计划时间或外部指令触发执行，
+# 省去每次由 cron 启动新解释器、重新导入依赖和重新握手的开销。
+# 启动: python xiaomi_daemon.py --at 08:00,20:00 --workers 8
+# 控制: python xiaomi_daemon.py status | run | reload | stop  （或 kill -USR1 <pid> 立即执行一轮）
+# 适用: 青龙面板，可参考 watch_tg_bot.sh 用 @boot 任务守护
+
+import os
+import jsoncodec
+import signal
+import socket
+import asyncio
+import threading
+import socketserver
+from datetime import datetime, timedelta
+
+import xiaomi
+
+COMMANDS = ('status', 'run', 'reload', 'stop')
+
+
+def parse_times(value):
+    """解析逗号分隔的 HH:MM 每日执行时间"""
+    times = []
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        hour, minute = (int(x) for x in item.split(':'))
+        if not (0 <= hour < 24 and 0 <= minute < 60):
+            raise ValueError(f"执行时间格式应为 HH:MM: {item}")
+        times.append((hour, minute))
+    return sorted(times)
+
+
+def next_run_time(times, now):
+    """now 之后最近的一个计划执行时间，没有计划时返回 None"""
+    candidates = []
+    for hour, minute in times:
+        at = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if at <= now:
+            at += timedelta(days=1)
+        candidates.append(at)
+    return min(candidates) if candidates else None
+
+
+class RunnerDaemon:
+    """
+    常驻执行器：主循环等待计划时间或触发事件，每轮调用 xiaomi.run_once。
+    跨轮复用共享连接池（thread/wheel 引擎的 SharedHTTPAdapter，async 引擎的连接器和事件循环）、
+    Cookie 缓存、任务记录、当日完成记录、任务目录和领奖记录；配置文件按修改时间判断是否需要重新读取。
+    运行指标、熔断和限流统计每轮重新开始。
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.times = parse_times(args.at)
+        self.cookie_cache = xiaomi.CookieCache(ttl=args.cookie_ttl * 3600) if args.cookie_ttl > 0 else None
+        self.history = xiaomi.HistoryStore() if xiaomi.HISTORY_FILE else None
+        self.done_cache = xiaomi.DoneCache() if xiaomi.DONE_FILE else None
+        self.task_catalog = xiaomi.TaskCatalog()
+        self.claim_ledger = xiaomi.ClaimLedger()
+        self.adapter = xiaomi.SharedHTTPAdapter(pool_connections=10, pool_maxsize=max(10, args.workers))
+        self.engine = xiaomi.SyncEngine(self.adapter, args.request_timeout)
+        self.loop = None
+        self.connector = None
+        if args.engine == 'async':
+            self._start_loop()
+
+        self._accounts = None
+        self._config_mtime = None
+        self._lock = threading.Lock()
+        # 信号处理函数中只设置事件，不获取 _lock，避免与主线程互相等待
+        self._wakeup = threading.Event()
+        self._run_requested = threading.Event()
+        self._reload_requested = threading.Event()
+        self._stopping = threading.Event()
+        self.state = 'idle'
+        self.started_at = datetime.now()
+        self.next_run = next_run_time(self.times, datetime.now())
+        self.runs = 0
+        self.last_run = None
+
+    def _start_loop(self):
+        """async 引擎在独立线程中常驻一个事件循环，连接器绑定在该循环上"""
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name='xiaomi-daemon-loop', daemon=True).start()
+
+        async def create():
+            return xiaomi.create_async_connector(limit=self.args.pool_size)
+
+        self.connector = asyncio.run_coroutine_threadsafe(create(), self.loop).result()
+
+    # ---------- 配置 ----------
+    def accounts(self):
+        """配置文件有变化时重新读取，否则返回上次解析的结果"""
+        mtime = os.path.getmtime(xiaomi.CONFIG_FILE)
+        with self._lock:
+            if self._accounts is None or mtime != self._config_mtime:
+                self._accounts = xiaomi.load_accounts()
+                self._config_mtime = mtime
+                print(f"已加载配置：{len(self._accounts)} 个账号")
+            return self._accounts
+
+    def _config_written(self, before, after):
+        """本轮写回 data.log 后更新记录的修改时间；写回前文件已被其他进程修改时保持原值，下一轮重新读取"""
+        with self._lock:
+            if before == self._config_mtime:
+                self._config_mtime = after
+
+    def reload(self):
+        with self._lock:
+            self._accounts = None
+        return self.accounts()
+
+    def request_reload(self):
+        self._reload_requested.set()
+        self._wakeup.set()
+
+    # ---------- 执行 ----------
+    def request_run(self):
+        self._run_requested.set()
+        self._wakeup.set()
+
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+
+    def warm_up(self):
+        """计划执行前预先建立到各接口域名的连接，减少正式执行时的握手"""
+        for base in (xiaomi.API_BASE, xiaomi.ACCOUNT_BASE):
+            try:
+                with xiaomi.new_session(self.adapter) as session:
+                    session.head(base, verify=False, timeout=5)
+            except Exception as e:
+                print(f"预热连接 {base} 失败: {e}")
+
+    def run_now(self):
+        start = datetime.now()
+        with self._lock:
+            self.state = 'running'
+        print(f"\n========== {start:%Y-%m-%d %H:%M:%S} 开始执行 ==========")
+        report = None
+        error = None
+        # 指标、熔断和限流是模块级的单例，每轮的统计互不累加
+        for stats in (xiaomi.METRICS, xiaomi.CIRCUIT_BREAKER, xiaomi.RATE_LIMITER):
+            stats.reset()
+        try:
+            accounts = self.accounts()
+            if accounts:
+                report = xiaomi.run_once(
+                    self.args, accounts,
+                    cookie_cache=self.cookie_cache,
+                    history=self.history,
+                    done_cache=self.done_cache,
+                    task_catalog=self.task_catalog,
+                    claim_ledger=self.claim_ledger,
+                    engine=self.engine,
+                    connector=self.connector,
+                    loop=self.loop,
+                    on_config_write=self._config_written,
+                )
+            if report:
+                print(xiaomi.run_summary(report))
+        except Exception as e:
+            error = str(e)
+            print(f"执行失败: {e}")
+        with self._lock:
+            self.state = 'idle'
+            self.runs += 1
+            self.last_run = {
+                'started_at': start.strftime("%Y-%m-%d %H:%M:%S"),
+                'elapsed': round((datetime.now() - start).total_seconds(), 1),
+                'success': report.success_count if report else 0,
+                'failure': report.failure_count if report else 0,
+                'error': error,
+            }
+
+    def serve(self):
+        """主循环：等待计划时间或触发事件；计划时间前 warmup 秒预热连接"""
+        warmed_for = None
+        while not self._stopping.is_set():
+            self._wakeup.clear()
+            if self._reload_requested.is_set():
+                self._reload_requested.clear()
+                try:
+                    self.reload()
+                except Exception as e:
+                    print(f"重新读取配置失败: {e}")
+
+            now = datetime.now()
+            due = self.next_run is not None and now >= self.next_run
+            if self._run_requested.is_set() or due:
+                self._run_requested.clear()
+                if due:
+                    self.next_run = next_run_time(self.times, now)
+                self.run_now()
+                continue
+
+            timeout = 3600
+            if self.next_run is not None:
+                until = (self.next_run - now).total_seconds()
+                if warmed_for == self.next_run:
+                    timeout = min(timeout, until)
+                elif until <= self.args.warmup:
+                    warmed_for = self.next_run
+                    self.warm_up()
+                    continue
+                else:
+                    timeout = min(timeout, until - self.args.warmup)
+            self._wakeup.wait(max(0.1, timeout))
+
+    def close(self):
+        if self.connector is not None:
+            asyncio.run_coroutine_threadsafe(self.connector.close(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        self.adapter.shutdown()
+
+    # ---------- 控制接口 ----------
+    def status(self):
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'state': self.state,
+                'engine': self.args.engine,
+                'started_at': self.started_at.strftime("%Y-%m-%d %H:%M:%S"),
+                'next_run': self.next_run.strftime("%Y-%m-%d %H:%M:%S") if self.next_run else None,
+                'runs': self.runs,
+                'last_run': self.last_run,
+                'accounts': len(self._accounts) if self._accounts is not None else None,
+            }
+
+    def handle_command(self, command):
+        if command == 'status':
+            return self.status()
+        if command == 'run':
+            self.request_run()
+            return {'ok': True, 'message': '已触发执行' if self.state == 'idle' else '当前轮结束后再执行一轮'}
+        if command == 'reload':
+            try:
+                return {'ok': True, 'accounts': len(self.reload())}
+            except Exception as e:
+                return {'ok': False, 'error': str(e)}
+        if command == 'stop':
+            self.stop()
+            return {'ok': True, 'message': '当前轮结束后退出'}
+        return {'ok': False, 'error': f"未知指令: {command}，可用: {', '.join(COMMANDS)}"}
+
+
+class ControlHandler(socketserver.StreamRequestHandler):
+    """控制接口：每个连接发送一行指令，返回一行 JSON"""
+
+    def handle(self):
+        command = self.rfile.readline().decode('utf-8').strip()
+        result = self.server.daemon_ref.handle_command(command)
+        self.wfile.write(jsoncodec.dumpb(result) + b'\n')
+
+
+def start_control_server(daemon, path):
+    """在 Unix 套接字上提供控制接口；不支持 Unix 套接字的系统只能用信号控制"""
+    if not hasattr(socket, 'AF_UNIX'):
+        print("当前系统不支持 Unix 套接字，控制接口不可用")
+        return None
+    if os.path.exists(path):
+        os.remove(path)
+    server = socketserver.ThreadingUnixStreamServer(path, ControlHandler)
+    server.daemon_threads = True
+    server.daemon_ref = daemon
+    threading.Thread(target=server.serve_forever, name='xiaomi-daemon-control', daemon=True).start()
+    return server
+
+
+def send_command(path, command, timeout=10):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall((command + '\n').encode('utf-8'))
+        data = b''
+        while not data.endswith(b'\n'):
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+    return jsoncodec.loads(data)
+
+
+def parse_args(argv=None):
+    parser = xiaomi.build_parser(description="小米钱包视频会员任务（常驻模式）")
+    parser.add_argument(
+        'command', nargs='?', choices=COMMANDS,
+        help="向已运行的常驻进程发送指令：status 查看状态 / run 立即执行 / reload 重新读取配置 / stop 退出",
+    )
+    parser.add_argument(
+        '--at',
+        default=os.environ.get('XIAOMI_DAEMON_AT', '08:00'),
+        help="逗号分隔的每日执行时间 HH:MM，留空则只在收到指令时执行（环境变量 XIAOMI_DAEMON_AT，默认 08:00）",
+    )
+    parser.add_argument(
+        '--control',
+        default=os.environ.get('XIAOMI_DAEMON_SOCKET', 'xiaomi_daemon.sock'),
+        help="控制接口的 Unix 套接字路径（环境变量 XIAOMI_DAEMON_SOCKET，默认 xiaomi_daemon.sock）",
+    )
+    parser.add_argument(
+        '--warmup', type=float,
+        default=float(os.environ.get('XIAOMI_DAEMON_WARMUP', '30')),
+        help="计划执行前多少秒预先建立连接（环境变量 XIAOMI_DAEMON_WARMUP，默认 30）",
+    )
+    parser.add_argument('--run-now', action='store_true', help="启动后立即执行一轮")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    if args.command:
+        try:
+            print(jsoncodec.dumps(send_command(args.control, args.command), indent=True))
+        except OSError as e:
+            print(f"无法连接常驻进程（{args.control}）: {e}")
+            exit(1)
+        return
+
+    if args.engine == 'async' and xiaomi.aiohttp is None:
+        print("async 引擎需要安装 aiohttp，请先运行 requirements.py")
+        exit(1)
+    if args.engine == 'async' and os.environ.get('XIAOMI_CASSETTE'):
+        # 录制/回放只挂在 requests 会话上，async 引擎会绕过它直接访问网络
+        print("录制/回放（XIAOMI_CASSETTE）只支持 thread 和 wheel 引擎，请去掉 --engine async")
+        exit(1)
+    try:
+        daemon = RunnerDaemon(args)
+        daemon.accounts()
+    except Exception as e:
+        print(f"启动失败: {e}")
+        exit(1)
+
+    server = start_control_server(daemon, args.control)
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: daemon.request_run())
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda signum, frame: daemon.request_reload())
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: daemon.stop())
+
+    print(f"常驻进程已启动（pid {os.getpid()}），下次执行: {daemon.next_run or '仅按指令执行'}")
+    if args.run_now:
+        daemon.request_run()
+    try:
+        daemon.serve()
+    finally:
+        if server:
+            server.shutdown()
+            server.server_close()
+            if os.path.exists(args.control):
+                os.remove(args.control)
+        daemon.close()
+        print("常驻进程已退出")
+
+
+if __name__ == "__main__":
+    main()